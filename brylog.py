@@ -11,16 +11,66 @@ import time
 import os
 import threading
 import libs.plotFrame as plf
-import queue
+import libs.sampleWriter as smw
+import libs.rollingStats as rst
+import libs.sampleBus as sbs
+import libs.sharedRing as shr
+import libs.metrics as mtr
+import libs.rotation as rtn
+import libs.recordFilter as rcf
+import libs.aggregates as agg
+import libs.timeIndex as tix
+import libs.brymen257 as br
 
 
 class ConfigFrame(tk.Frame):
-    def __init__(self, root, device, delay, **rest):
+    def __init__(self, root, device, delay, chunked=True, flushInterval=1.0,
+                 flushCount=1000, statsWindow=1000, historySize=2 ** 18,
+                 plotBufferSize=10000, saveBufferSize=2 ** 16,
+                 separateProcess=False, metricsFile=None,
+                 metricsInterval=10.0, rotateBytes=None, rotateInterval=None,
+                 compression=None, deadband=None, relativeDeadband=None,
+                 heartbeat=60.0, aggregateTiers=None,
+                 aggregateRetention=None, rawRetention=None, indexEvery=1000,
+                 indexInterval=60.0, **rest):
         """Arguments:
 
             root -> root widget for config frame,
             device -> serial device object
             delay -> delay time (see plotFrame.py)
+            chunked -> read all available frames at once (device.readData)
+                       instead of one blocking frame read (device.getData)
+            flushInterval -> max time (s) between saving and file flush
+            flushCount -> max number of saved samples not flushed to file
+            statsWindow -> number of samples in displayed statistics
+            historySize -> number of plotted samples (see plotFrame.py)
+            plotBufferSize -> max samples waiting for plot (oldest dropped)
+            saveBufferSize -> max samples waiting for saving (producer
+                              waits if full)
+            separateProcess -> read device in separate process (see
+                               sharedRing.py), GUI doesn't disturb reading
+            metricsFile -> Prometheus text file with pipeline metrics,
+                           save/brylog.prom if None
+            metricsInterval -> metrics file writing interval (s), 0 = off
+            rotateBytes -> max saved file segment size, None = no limit
+            rotateInterval -> saved file segment time span (s, segments
+                              start on its multiples), None = no limit
+            compression -> 'gz', 'xz' or None, compression of closed
+                           segments (see rotation.py)
+            deadband -> absolute deadband of saved samples (0 = changes
+                        only), None = every sample (see recordFilter.py)
+            relativeDeadband -> deadband relative to the recorded value
+            heartbeat -> max time (s) between filtered records
+            aggregateTiers -> aggregate bucket lengths (s) kept in
+                              save/aggregates <port> <tier>s.agg files
+                              (e.g. aggregates.TIERS), None = off (see
+                              aggregates.py)
+            aggregateRetention -> dict: tier -> max age (s) of aggregates
+            rawRetention -> max age (s) of saved files in save/ (checked
+                            hourly), None = forever, aggregates are kept
+            indexEvery -> text logs time index entry every indexEvery
+                          samples, 0 = no index (see timeIndex.py)
+            indexInterval -> max time (s) between index entries
             **rest -> rest of dict arguments inherited from tkinter.Frame"""
         tk.Frame.__init__(self, master=root, **rest)
         self.serialPath = None
@@ -32,6 +82,12 @@ class ConfigFrame(tk.Frame):
         self.conEstablished = False
         self.delay = delay
         self.device = device
+        self.chunked = chunked
+        self.separateProcess = separateProcess
+        self.acquisition = None  # sharedRing.AcquisitionProcess object
+        self.loopsStarted = False  # plot, stats, metrics tkinter loops
+        self.ringReader = None   # sharedRing.RingReader object
+        self.ringStop = None     # stops ring reading thread (Event)
         #---------------------config section-----------------------------------
         self.conFr = tk.Frame(master=self, **cfd.frConf)
         self.conFr.grid(row=0, column=0, columnspan=2, sticky=tk.NSEW)
@@ -84,34 +140,277 @@ class ConfigFrame(tk.Frame):
                  **cfd.lbConfSmall).grid(row=3, column=0, sticky=tk.E)
         self.fileL = tk.Label(master=self.conectFr, text='NONE', fg='red')
         self.fileL.grid(row=3, column=1, sticky=tk.W)
+        tk.Label(master=self.conectFr, text='Format:',
+                 **cfd.lbConfSmall).grid(row=4, column=0, sticky=tk.E)
+        self.saveFormat = tk.StringVar()
+        self.saveFormat.set('.txt')
+        formatFr = tk.Frame(master=self.conectFr)
+        formatFr.grid(row=4, column=1, sticky=tk.W)
+        for (i, (t, v)) in enumerate((('text', '.txt'), ('binary', '.bin'),
+                                      ('raw frames', '.raw'),
+                                      ('runs', '.runs'))):
+            tk.Radiobutton(master=formatFr, text=t, value=v,
+                           variable=self.saveFormat).grid(row=0, column=i,
+                                                          sticky=tk.W)
         self.fileName = ''
-        self.fo = None  # file object variable
+        self.writer = None  # sampleWriter.BatchWriter object variable
+        self.flushInterval = flushInterval
+        self.flushCount = flushCount
         self.saveDir = os.path.join(os.getcwd(), 'save')
+        self.rotateBytes = rotateBytes
+        self.rotateInterval = rotateInterval
+        self.compression = compression
+        self.deadband = deadband
+        self.relativeDeadband = relativeDeadband
+        self.heartbeat = heartbeat
+        self.indexEvery = indexEvery
+        self.indexInterval = indexInterval
 
         #------------multithreading variables----------------------------------
-        self.plotQueue = queue.Queue()
-        self.saveQueue = queue.Queue()
+        self.bus = sbs.SampleBus()      # producer -> plot, save, stats
+        self.plotQueue = self.bus.subscribe('plot', plotBufferSize,
+                                            sbs.DROP_OLDEST)
+        self.saveQueue = None           # subscribed only while saving
+        self.saveError = None           # saving thread failure message
+        self.saveBufferSize = saveBufferSize
+        self.stats = rst.RollingStats(window=statsWindow)
+        self.bus.listen(self._updateStats)
+        self.decodeErrors = 0           # br.ERROR_VALUE readings
+        self.aggregateTiers = aggregateTiers
+        self.aggregateRetention = aggregateRetention
+        self.rawRetention = rawRetention
+        self.aggregator = None          # aggregates.Aggregator object
+        self.bus.listen(self._aggregate)
+
+        #--------------metrics-------------------------------------------------
+        self.metricsFile = metricsFile or os.path.join(self.saveDir,
+                                                       'brylog.prom')
+        self.metricsInterval = metricsInterval
+        self.lastMetrics = time.monotonic()
+        self.metrics = mtr.Registry()
+        self._registerMetrics()
+
+        #--------------statistics section--------------------------------------
+        self.statsFr = tk.Frame(master=self, **cfd.frConf)
+        self.statsFr.grid(row=2, column=0, columnspan=2, sticky=tk.NSEW)
+        tk.Label(master=self.statsFr, text='STATISTICS',
+                 **cfd.lbConf).grid(row=0, column=0, columnspan=2)
+        self.statsL = {}
+        for (i, name) in enumerate(('count', 'min', 'max', 'mean', 'std',
+                                    'errors')):
+            tk.Label(master=self.statsFr, text=name + ':',
+                     **cfd.lbConfSmall).grid(row=i + 1, column=0,
+                                             sticky=tk.E)
+            self.statsL[name] = tk.Label(master=self.statsFr, text='NONE',
+                                         **cfd.lbConfSmall)
+            self.statsL[name].grid(row=i + 1, column=1, sticky=tk.W)
+
+        #--------------status section------------------------------------------
+        self.statusFr = tk.Frame(master=self, **cfd.frConf)
+        self.statusFr.grid(row=3, column=0, columnspan=2, sticky=tk.NSEW)
+        tk.Label(master=self.statusFr, text='STATUS',
+                 **cfd.lbConf).grid(row=0, column=0, columnspan=2)
+        self.statusL = {}
+        for (i, name) in enumerate(('frames', 'rejected', 'restarts',
+                                    'plot queue', 'save queue', 'dropped',
+                                    'write ms', 'render ms')):
+            tk.Label(master=self.statusFr, text=name + ':',
+                     **cfd.lbConfSmall).grid(row=i + 1, column=0,
+                                             sticky=tk.E)
+            self.statusL[name] = tk.Label(master=self.statusFr, text='NONE',
+                                          **cfd.lbConfSmall)
+            self.statusL[name].grid(row=i + 1, column=1, sticky=tk.W)
 
         #---------plot section ------------------------------------------------
         self.plotFr = tk.Frame(master=self, **cfd.frConf)
-        self.plotFr.grid(row=0, column=2, rowspan=2, sticky=tk.EW)
-        self.plot = plf.PlotFrame(self.plotFr, self.plotQueue, self.delay)
+        self.plotFr.grid(row=0, column=2, rowspan=4, sticky=tk.EW)
+        self.plot = plf.PlotFrame(self.plotFr, self.plotQueue, self.delay,
+                                  historySize=historySize,
+                                  renderTime=self.renderTime)
         self.plot.grid()
 
     def _mainDataProducer(self):
         """main data producer thread"""
         while self.conEstablished:
-            temp = self.device.getData()
-            self.plotQueue.put(temp)
-            if not self.saveQueue.full():  # saving check
-                self.saveQueue.put(temp)
+            writer = self.writer
+            if(writer is not None and writer.raw):
+                # raw capture : no decoding in this thread (see rawCapture)
+                self.bus.publish([(time.monotonic_ns(), frame)
+                                  for frame in self.device.readFrames()])
+            elif(self.chunked):
+                self.bus.publish(list(self.device.readData()))
+            else:
+                self.bus.publish([self.device.getData()])
+
+    def _ringDataProducer(self, reader, stopEvent):
+        """data producer thread for separate acquisition process
+
+        Arguments:
+            reader    -> sharedRing.RingReader object
+            stopEvent -> threading.Event, set before the ring is closed"""
+        while self.conEstablished and not stopEvent.is_set():
+            self.bus.publish(reader.readSamples())
+            time.sleep(self.delay / 1000)
+
+    def _stopAcquisition(self):
+        """stops ring reading thread, then acquisition process and its
+        shared ring"""
+        if(self.acquisition is None):
+            return
+        self.ringStop.set()
+        self.thr.join()
+        self.acquisition.stop()
+        self.acquisition = None
+
+    def _checkAcquisition(self, acquisition):
+        """reports failure of acquisition process (tkinter loop, every
+        1000 ms while the process is used)
+
+        Arguments:
+            acquisition -> sharedRing.AcquisitionProcess object"""
+        if(acquisition is not self.acquisition):
+            return                      # stopped or replaced
+        error = acquisition.error()
+        if(error is None):
+            self.after(1000, self._checkAcquisition, acquisition)
+            return
+        self._stopAcquisition()
+        self.conEstablished = False
+        if(self.writer is not None):
+            self._closeWriter()
+            self.fileL.config(text='NONE', **cfd.lbConfSmallRed)
+        self.pathL.config(text='NONE', **cfd.lbConfSmallRed)
+        msb.showerror(message='Acquisition process failed!\n' + error)
+
+    def _updateStats(self, samples):
+        """sample bus listener, feeds statistics (producer thread)"""
+        if(len(samples[0]) == 2):      # raw capture records aren't decoded
+            return
+        for temp in samples:
+            if(temp[1] == br.ERROR_VALUE):
+                self.decodeErrors += 1
+            self.stats.update(*temp)
+
+    def _registerMetrics(self):
+        """registers pipeline metrics (values are read on snapshot)"""
+        m = self.metrics
+        m.counter('frames_read_total', 'aligned frames read from device',
+                  lambda: self._deviceCounters()['frames'])
+        m.counter('frames_rejected_total', 'misaligned frames (_isOK)',
+                  lambda: self._deviceCounters()['resyncs'])
+        m.counter('rejected_bytes_total', 'bytes skipped by resync',
+                  lambda: self._deviceCounters()['droppedBytes'])
+        m.counter('device_restarts_total', 'serial port restarts',
+                  lambda: self._deviceCounters()['restarts'])
+        m.counter('frame_cache_hits_total', 'frames decoded from cache',
+                  lambda: self._deviceCounters()['cacheHits'])
+        m.counter('frame_cache_misses_total', 'frames decoded in full',
+                  lambda: self._deviceCounters()['cacheMisses'])
+        m.counter('decode_errors_total', 'lcd error (-1000) readings',
+                  lambda: self.decodeErrors)
+        m.gauge('plot_queue_depth', 'samples waiting for plot',
+                lambda: self.plotQueue.qsize())
+        m.counter('plot_dropped_total', 'samples dropped by plot queue',
+                  lambda: self.plotQueue.dropped)
+        m.gauge('save_queue_depth', 'samples waiting for saving',
+                lambda: self.saveQueue.qsize())
+        m.counter('ring_lost_total', 'samples overwritten in shared ring',
+                  lambda: self.ringReader.lost)
+        m.gauge('saved_samples', 'samples written to current file',
+                lambda: self.writer.written)
+        m.gauge('saved_flushes', 'flushes of current file',
+                lambda: self.writer.flushes)
+        m.gauge('saved_skipped', 'records of the other mode skipped by '
+                'current file writer', lambda: self.writer.skipped)
+        self.writeLatency = m.histogram('write_latency_seconds',
+                                        'batch write and flush time')
+        self.renderTime = m.histogram('render_seconds', 'plot frame time')
+
+    def _deviceCounters(self):
+        """returns dict of device counters (see sharedRing.COUNTERS), read
+        from the shared ring if acquisition runs in separate process"""
+        if(self.acquisition is not None):
+            return self.acquisition.ring.counters()
+        return dict(zip(shr.COUNTERS, shr.deviceCounters(self.device)))
+
+    def metricsSnapshot(self):
+        """returns pipeline metrics snapshot (see metrics.Registry)"""
+        return self.metrics.snapshot()
+
+    def _showMetrics(self):
+        """refreshes status labels and writes metrics file (tkinter loop,
+        every 1000 ms)"""
+        values = self.metrics.snapshot()
+        p = self.metrics.prefix
+        dropped = (values[p + 'plot_dropped_total'] or 0) + \
+            (values[p + 'ring_lost_total'] or 0)
+        texts = {'frames': values[p + 'frames_read_total'],
+                 'rejected': values[p + 'frames_rejected_total'],
+                 'restarts': values[p + 'device_restarts_total'],
+                 'plot queue': values[p + 'plot_queue_depth'],
+                 'save queue': values[p + 'save_queue_depth'],
+                 'dropped': dropped,
+                 'write ms': values[p + 'write_latency_seconds']['mean'],
+                 'render ms': values[p + 'render_seconds']['mean']}
+        for (name, value) in texts.items():
+            if(value is not None and name.endswith(' ms')):
+                value = round(value * 1000, 3)
+            self.statusL[name].config(text='NONE' if value is None
+                                      else str(value))
+        if(self.metricsInterval and time.monotonic() - self.lastMetrics >=
+           self.metricsInterval):
+            self.lastMetrics = time.monotonic()
+            try:
+                os.makedirs(os.path.dirname(self.metricsFile), exist_ok=True)
+                self.metrics.writeTextFile(self.metricsFile)
+            except OSError:
+                pass                    # metrics never stop logging
+        self.after(1000, self._showMetrics)
+
+    def _aggregate(self, samples):
+        """sample bus listener, feeds aggregates (producer thread)"""
+        aggregator = self.aggregator
+        if(aggregator is not None):
+            aggregator.update(samples)
+
+    def _startAggregates(self):
+        """opens aggregate files of the connected device"""
+        (aggregator, self.aggregator) = (self.aggregator, None)
+        if(aggregator is not None):
+            aggregator.close()
+        if(not self.aggregateTiers):
+            return
+        if(not os.path.exists(self.saveDir)):
+            os.mkdir(path=self.saveDir, mode=0o755)
+        self.aggregator = agg.Aggregator(
+            os.path.join(self.saveDir, 'aggregates ' +
+                         os.path.basename(self.serialPath)),
+            self.aggregateTiers, self.aggregateRetention,
+            flushInterval=self.flushInterval * 10)
+
+    def _pruneRaw(self):
+        """raw data retention (tkinter loop, every hour)"""
+        if(self.rawRetention is not None and os.path.exists(self.saveDir)):
+            agg.pruneFiles(self.saveDir, self.rawRetention)
+        self.after(3600000, self._pruneRaw)
+
+    def _showStats(self):
+        """refreshes statistics labels (tkinter loop, every 500 ms)"""
+        stats = self.stats.snapshot()
+        for name in self.statsL:
+            value = getattr(stats, name)
+            text = 'NONE' if value is None else '%g' % value
+            self.statsL[name].config(text=text)
+        self.after(500, self._showStats)
 
     def _quit(self):
         """quit button handler"""
         self.conEstablished = False
-        self.savingStatus = False
-        if self.fo:
-            self.fo.close()
+        if self.writer:
+            self._closeWriter()
+        self._stopAcquisition()
+        if self.aggregator:
+            self.aggregator.close()
         self.master.destroy()
 
     def _saveToFile(self):
@@ -119,41 +418,99 @@ class ConfigFrame(tk.Frame):
         if(not self.conEstablished):
             msb.showerror(message='Device not ready')
             return
+        saveFormat = self.saveFormat.get()
+        if(self.acquisition is not None and saveFormat == '.raw'):
+            msb.showerror(message='Raw frames are not available\n'
+                                  'with separate acquisition process')
+            return
         self.fileName = (time.strftime("%Y_%m_%d %H_%M_%S", time.gmtime()) +
-                         ' ' + os.path.basename(self.device.port) + '.txt')
+                         ' ' + os.path.basename(self.device.port) +
+                         saveFormat)
         #file operations require save dir
         if(not os.path.exists(self.saveDir)):
             os.mkdir(path=self.saveDir, mode=755)
-        if(not self.fo is None):
+        if(not self.writer is None):
             msb.showerror(message='SAVING IS PROCEEDING ALREADY')
             return
         self.fileL.config(text=self.fileName[:6] + '...', **cfd.lbConfSmall)
-        self.savingStatus = True
-        self.thr3 = threading.Thread(target=self._saving, args=(),
+        writerClass = smw.writerClass(saveFormat)
+        fileName = os.path.join(self.saveDir, self.fileName)
+        arguments = {'flushInterval': self.flushInterval,
+                     'flushCount': self.flushCount,
+                     'latency': self.writeLatency}
+        if(self.rotateBytes or self.rotateInterval or self.compression):
+            self.writer = rtn.RotatingWriter(fileName, writerClass,
+                                             self.rotateBytes,
+                                             self.rotateInterval,
+                                             self.compression, **arguments)
+        else:
+            self.writer = writerClass(fileName, **arguments)
+            if(self.indexEvery and saveFormat in ('.txt', '.runs')):
+                self.writer = tix.IndexedWriter(self.writer, self.indexEvery,
+                                                self.indexInterval)
+        recordFilter = None if self.writer.raw else rcf.createFilter(
+            saveFormat, self.deadband, self.relativeDeadband, self.heartbeat)
+        if(recordFilter is not None):
+            self.writer = rcf.FilteredWriter(self.writer, recordFilter)
+        if(self.writer.raw):  # producer doesn't decode, statistics stop
+            self.stats.clear()
+        self.saveQueue = self.bus.subscribe('save', self.saveBufferSize,
+                                            sbs.BLOCK)
+        self.saveError = None
+        self.thr3 = threading.Thread(target=self._saving,
+                                     args=(self.writer, self.saveQueue),
                                      daemon=True)  # daemon!!! very important
         self.thr3.start()
+        self.after(1000, self._checkSaving, self.thr3)
 
-    def _saving(self):
+    def _saving(self, writer, saveQueue):
         """saves data to file. File name=datetime.datetime() + self.file_Name.
-        Format : time.time()\tvalue\tunit\n"""
-        saveFile = os.path.join(self.saveDir, self.fileName)
-        self.fo = open(saveFile, 'a')
-        while True:
+        Format : time.time()\tvalue\tunit\t\n (written in batches)
+
+        Arguments:
+            writer    -> sampleWriter.BatchWriter compatible object
+            saveQueue -> sampleBus.Subscription object (BLOCK policy)"""
+        try:
+            writer.drain(saveQueue)
+        except Exception as error:      # e.g. OSError on full disk
+            # nothing drains the queue any more, producer mustn't wait
+            self.bus.unsubscribe(saveQueue)
+            self.saveError = '%s: %s' % (type(error).__name__, error)
             try:
-                temp = self.saveQueue.get()
-                for i in temp:
-                    self.fo.write(str(i) + '\t')
-                self.fo.write('\n')
-                self.fo.flush()  # don't buffer
-                self.saveQueue.task_done()
-            except AttributeError:
-                break  # end thread silently (must be a daemon!!!)
+                writer.close()
+            except Exception:
+                pass
+
+    def _checkSaving(self, thread):
+        """reports failure of saving thread (tkinter loop, every 1000 ms
+        while the thread works)
+
+        Arguments:
+            thread -> saving threading.Thread object"""
+        if(thread is not self.thr3):
+            return                      # replaced by new saving
+        if(thread.is_alive()):
+            self.after(1000, self._checkSaving, thread)
+            return
+        if(self.saveError is None):
+            return                      # stopped by _closeWriter
+        self.saveQueue = None
+        self.writer = None
+        self.fileL.config(text='NONE', **cfd.lbConfSmallRed)
+        msb.showerror(message='Saving failed!\n' + self.saveError)
+
+    def _closeWriter(self):
+        """stops saving thread after it writes all queued samples"""
+        self.bus.unsubscribe(self.saveQueue)
+        self.saveQueue.put(smw.STOP)
+        self.thr3.join()
+        self.saveQueue = None
+        self.writer = None
 
     def _stopSaving(self):
-        """kills saving thread"""
-        if(not self.fo is None):
-            self.fo.close()  # cleaning after nasty thread
-            self.fo = None
+        """stops saving thread"""
+        if(not self.writer is None):
+            self._closeWriter()
             self.fileL.config(text='NONE', **cfd.lbConfSmallRed)
         else:
             msb.showerror(message='NO FILE TO CLOSE')
@@ -191,6 +548,7 @@ class ConfigFrame(tk.Frame):
         self.device.parity = self.serialParity    # |-> for info label
         self.device.stopbits = self.serialSbits   # |
         self.device.timeout = self.serialTimeout  # /
+        self._stopAcquisition()  # the child process holds the port
         self.device.close()
         self.device.open()
         time.sleep(0.3)
@@ -204,21 +562,41 @@ class ConfigFrame(tk.Frame):
             self.sbitsL.config(text=self.serialSbits, **cfd.lbConfSmall)
             self.timeL.config(text=self.serialTimeout, **cfd.lbConfSmall)
             msb.showinfo(message='Connection established')
+            self._startAggregates()
             #start data producer thread asap
-            self.thr = threading.Thread(target=self._mainDataProducer,
-                                        args=())
+            if(self.separateProcess):
+                self.device.close()  # the port belongs to the child process
+                self.acquisition = shr.AcquisitionProcess(
+                    {'port': self.serialPath, 'baudrate': self.serialBaud,
+                     'bytesize': self.serialBsize,
+                     'parity': self.serialParity,
+                     'stopbits': self.serialSbits,
+                     'timeout': self.serialTimeout})
+                self.acquisition.start()
+                self.ringReader = self.acquisition.reader()
+                self.ringStop = threading.Event()
+                self.thr = threading.Thread(target=self._ringDataProducer,
+                                            args=(self.ringReader,
+                                                  self.ringStop),
+                                            daemon=True)
+                self.after(1000, self._checkAcquisition, self.acquisition)
+            else:
+                self.thr = threading.Thread(target=self._mainDataProducer,
+                                            args=())
             self.thr.start()
-            #begin plotting immediately in the separate thread
-            self.thr2 = threading.Thread(target=self.plot.plot, args=())
-            self.thr2.start()
+            #begin plotting immediately (tkinter loop, never blocks)
+            if(not self.loopsStarted):  # loops survive reconnections
+                self.loopsStarted = True
+                self.after(self.delay, self.plot.plot)
+                self.after(500, self._showStats)
+                self.after(1000, self._showMetrics)
+                self.after(1000, self._pruneRaw)
         else:
             self.conEstablished = False
             msb.showwarning(message='Connection failed!\nCheck your device.')
 
 
 if __name__ == '__main__':
-    import libs.brymen257 as br
-
     root = tk.Tk()
     multimeter = br.Brymen257(None)
     root.title('BRYMEN 257 MULTIMETER')
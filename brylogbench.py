@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+reproducible benchmarks of decoding, saving and plotting hot paths,
+results are written as JSON for comparison between commits
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import libs.brymen257 as br
+import libs.logLoader as ll
+import libs.sampleBus as sbs
+import libs.sampleWriter as smw
+import libs.simulator as sim
+
+BENCHMARKS = ('decode', 'pipeline', 'load', 'plot')
+
+
+def parseArguments(argv=None):
+    """command line parser
+
+    Arguments:
+        argv -> list of arguments, sys.argv[1:] if None
+
+    Returns:
+        argparse.Namespace"""
+    parser = argparse.ArgumentParser(description='Brymen 257 logger '
+                                                 'benchmarks')
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON results file (default: - for stdout)')
+    parser.add_argument('-n', '--frames', type=int, default=100000,
+                        help='dataset size (frames)')
+    parser.add_argument('--capture', default=None,
+                        help='raw capture file dataset (default: synthetic)')
+    parser.add_argument('--seed', type=int, default=257,
+                        help='synthetic dataset random seed')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of runs, the best one is reported')
+    parser.add_argument('--plot-frames', type=int, default=200,
+                        help='number of rendered plot frames')
+    parser.add_argument('--plot-batch', type=int, default=10,
+                        help='number of new samples per plot frame')
+    parser.add_argument('benchmarks', nargs='*', default=BENCHMARKS,
+                        help='benchmarks to run: ' + ', '.join(BENCHMARKS))
+    return parser.parse_args(argv)
+
+
+def dataset(size, seed=257, capture=None):
+    """returns fixed list of raw frames
+
+    Arguments:
+        size    -> number of frames
+        seed    -> synthetic signal random seed
+        capture -> raw capture file (repeated up to size), None = synthetic
+                   noisy sine with changing unit and stable periods
+
+    Returns:
+        list of 15 bytes raw frames"""
+    if(capture is not None):
+        source = sim.replay(capture, loop=True)
+    else:
+        signal = sim.waveform('sine', 5.0, 0.001, 0.0, 0.01, seed)
+        source = (sim.encodeFrame(round(signal(i), 2) if i % 1000 < 800
+                                  else 1.25, '=V' if i % 5000 else '~A')
+                  for i in range(size))
+    frames = []
+    for frame in source:
+        frames.append(frame)
+        if(len(frames) >= size):
+            break
+    return frames
+
+
+def best(function, repeat):
+    """returns the shortest time (s) of repeated function calls"""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchDecode(frames, repeat):
+    """decoded frames per second of every decoder
+
+    Returns:
+        dict: decoder -> {'seconds', 'frames_per_second'}"""
+    device = br.Brymen257(None)
+    decodeFrame = br.decode_frame
+    buffer = b''.join(frames)
+    decoders = {'Brymen257._setFrame':
+                lambda: [device._setFrame(frame) for frame in frames],
+                'decode_frame':
+                lambda: [decodeFrame(frame, 0.0) for frame in frames],
+                'decode_frames': lambda: br.decode_frames(buffer, 0.0),
+                'FrameCache.decode':
+                lambda: [br.FrameCache().decode(frame, 0.0)
+                         for frame in frames]}
+    results = {}
+    for (name, function) in decoders.items():
+        seconds = best(function, repeat)
+        results[name] = {'seconds': seconds,
+                         'frames_per_second': len(frames) / seconds}
+    cache = br.FrameCache()
+    for frame in frames:
+        cache.decode(frame, 0.0)
+    results['FrameCache.decode']['hit_ratio'] = cache.hits / len(frames)
+    return results
+
+
+def runPipeline(frames, extension, directory):
+    """_mainDataProducer -> sample bus -> _saving path fed by simulator
+    as fast as possible
+
+    Arguments:
+        frames    -> list of raw frames
+        extension -> writer format ('.txt', '.bin', '.raw')
+        directory -> output directory
+
+    Returns:
+        dict with elapsed time, samples and file size"""
+    simulator = sim.Simulator(frames, rate=None, blocking=True)
+    device = br.Brymen257(None)
+    device.port = simulator.port
+    device.timeout = 1
+    device.open()
+    fileName = os.path.join(directory, 'bench' + extension)
+    if(os.path.exists(fileName)):
+        os.remove(fileName)
+    writer = smw.writerClass(extension)(fileName)
+    bus = sbs.SampleBus()
+    saveQueue = bus.subscribe('save', 2 ** 16, sbs.BLOCK)
+    saving = threading.Thread(target=writer.drain, args=(saveQueue,))
+    start = time.perf_counter()
+    saving.start()
+    simulator.start(count=len(frames))
+    produced = 0
+    while produced < len(frames):
+        if(writer.raw):
+            batch = [(time.monotonic_ns(), frame)
+                     for frame in device.readFrames(0.5)]
+        else:
+            batch = list(device.readData(0.5))
+        if(not batch and not simulator.running):
+            break                        # frames lost (shouldn't happen)
+        bus.publish(batch)
+        produced += len(batch)
+    saveQueue.put(smw.STOP)
+    saving.join()
+    seconds = time.perf_counter() - start
+    simulator.close()
+    device.close()
+    size = os.path.getsize(fileName)
+    os.remove(fileName)
+    return {'seconds': seconds, 'samples': produced, 'bytes': size}
+
+
+def benchPipeline(frames, repeat):
+    """end-to-end samples per second and bytes written per sample of every
+    save format
+
+    Returns:
+        dict: format -> results"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in ('.txt', '.bin', '.raw'):
+            runs = [runPipeline(frames, extension, directory)
+                    for i in range(repeat)]
+            run = min(runs, key=lambda run: run['seconds'])
+            results[extension[1:]] = {
+                'seconds': run['seconds'],
+                'samples': run['samples'],
+                'samples_per_second': run['samples'] / run['seconds'],
+                'bytes_per_sample': run['bytes'] / max(run['samples'], 1)}
+    return results
+
+
+def readLines(fileName):
+    """line by line text log reader (reference for benchLoad)"""
+    with open(fileName, 'r') as fi:
+        return [(float(fields[0]), float(fields[1]), fields[2])
+                for fields in (line.split('\t') for line in fi)]
+
+
+def benchLoad(frames, repeat):
+    """loaded samples per second of text log readers
+
+    Returns:
+        dict: reader -> {'seconds', 'samples_per_second'}"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'bench.txt')
+        writer = smw.BatchWriter(fileName)
+        writer.write([br.decode_frame(frame, 1.7e9 + i / 10) for (i, frame)
+                      in enumerate(frames)])
+        writer.close()
+        readers = {'readLines': lambda: readLines(fileName),
+                   'logLoader.load': lambda: ll.load(fileName)}
+        for (name, function) in readers.items():
+            seconds = best(function, repeat)
+            results[name] = {'seconds': seconds,
+                             'samples_per_second': len(frames) / seconds}
+    return results
+
+
+def benchPlot(frames, count, batch):
+    """PlotFrame.plot render time per frame (needs display)
+
+    Arguments:
+        frames -> list of raw frames
+        count  -> number of rendered frames
+        batch  -> number of new samples per frame
+
+    Returns:
+        dict: mode -> render time statistics in ms"""
+    import queue
+    import tkinter as tk
+    import libs.plotFrame as plf
+    try:
+        root = tk.Tk()
+    except tk.TclError as error:
+        return {'skipped': str(error)}
+    samples = [br.decode_frame(frame, i / 10) for (i, frame) in
+               enumerate(frames[:count * batch])]
+    results = {}
+    for blit in (True, False):
+        plotQueue = queue.Queue()
+        frame = plf.PlotFrame(root, plotQueue, delay=10 ** 9, blit=blit)
+        root.update()
+        times = []
+        for i in range(0, len(samples), batch):
+            for sample in samples[i:i + batch]:
+                plotQueue.put(sample)
+            start = time.perf_counter()
+            frame.plot()
+            times.append((time.perf_counter() - start) * 1000)
+        frame.canvas.get_tk_widget().destroy()
+        frame.destroy()
+        times.sort()
+        results['blit' if blit else 'full'] = {
+            'frames': len(times),
+            'mean_ms': sum(times) / len(times),
+            'median_ms': times[len(times) // 2],
+            'p95_ms': times[int(len(times) * 0.95)],
+            'max_ms': times[-1]}
+    root.destroy()
+    return results
+
+
+def metadata(args):
+    """returns environment and dataset description"""
+    try:
+        commit = subprocess.check_output(
+            ('git', 'rev-parse', 'HEAD'), stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'frames': args.frames,
+            'dataset': args.capture or 'synthetic seed %d' % args.seed,
+            'repeat': args.repeat}
+
+
+def main(argv=None):
+    """command line entry point"""
+    args = parseArguments(argv)
+    for name in args.benchmarks:
+        if(name not in BENCHMARKS):
+            sys.exit('unknown benchmark: ' + name)
+    frames = dataset(args.frames, args.seed, args.capture)
+    results = {'meta': metadata(args)}
+    if('decode' in args.benchmarks):
+        results['decode'] = benchDecode(frames, args.repeat)
+    if('pipeline' in args.benchmarks):
+        results['pipeline'] = benchPipeline(frames, args.repeat)
+    if('load' in args.benchmarks):
+        results['load'] = benchLoad(frames, args.repeat)
+    if('plot' in args.benchmarks):
+        results['plot'] = benchPlot(frames, args.plot_frames,
+                                    args.plot_batch)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if(args.output == '-'):
+        print(text)
+    else:
+        with open(args.output, 'w') as fo:
+            fo.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""
+headless Brymen 257 logger for one or many multimeters
+(no tkinter, no matplotlib)
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+import serial
+import libs.brymen257 as br
+import libs.sampleWriter as smw
+import libs.acquisition as acq
+import libs.rollingStats as rst
+import libs.rotation as rtn
+import libs.recordFilter as rcf
+import libs.aggregates as agg
+import libs.timeIndex as tix
+
+PARITIES = {'N': serial.PARITY_NONE, 'E': serial.PARITY_EVEN,
+            'O': serial.PARITY_ODD}
+
+
+def addSerialArguments(parser):
+    """adds serial device options (--port, --baudrate, ...) to the parser
+
+    Arguments:
+        parser -> argparse.ArgumentParser object"""
+    parser.add_argument('-p', '--port', action='append', default=None,
+                        help='serial device, repeat for many multimeters '
+                             '(default: /dev/ttyUSB0)')
+    parser.add_argument('-b', '--baudrate', type=int, default=9600,
+                        choices=(2400, 4800, 9600))
+    parser.add_argument('--bytesize', type=int, default=8,
+                        choices=(5, 6, 7, 8))
+    parser.add_argument('--parity', default='N', choices=sorted(PARITIES))
+    parser.add_argument('--stopbits', type=int, default=1, choices=(1, 2))
+    parser.add_argument('--timeout', type=float, default=1,
+                        help='serial read timeout in seconds')
+
+
+def parseArguments(argv=None):
+    """command line parser
+
+    Arguments:
+        argv -> list of arguments, sys.argv[1:] if None
+
+    Returns:
+        argparse.Namespace"""
+    parser = argparse.ArgumentParser(description='Brymen 257 headless logger')
+    addSerialArguments(parser)
+    parser.add_argument('-o', '--output', default=None,
+                        help='output file (default: save/<date> <port>.<fmt>,'
+                             ' - for stdout text), output directory for many '
+                             'ports')
+    parser.add_argument('-f', '--format', default=None,
+                        choices=('txt', 'bin', 'raw', 'runs'),
+                        help='output format (default: from --output '
+                             'extension or txt)')
+    parser.add_argument('-d', '--duration', type=float, default=None,
+                        help='stop after DURATION seconds')
+    parser.add_argument('-n', '--count', type=int, default=None,
+                        help='stop after COUNT samples (per device)')
+    parser.add_argument('--flush-interval', type=float, default=1.0,
+                        help='max time (s) between write and flush')
+    parser.add_argument('--flush-count', type=int, default=1000,
+                        help='max number of not flushed samples')
+    parser.add_argument('--deadband', type=float, default=None,
+                        help='record sample only if it moves more than '
+                             'DEADBAND from the last recorded one '
+                             '(0 = changes only), run tolerance of runs')
+    parser.add_argument('--relative-deadband', type=float, default=None,
+                        help='deadband relative to the recorded value')
+    parser.add_argument('--heartbeat', type=float, default=60.0,
+                        help='max time (s) between filtered records')
+    parser.add_argument('--rotate-size', type=int, default=None,
+                        help='start new output segment after ROTATE_SIZE '
+                             'bytes')
+    parser.add_argument('--rotate-interval', type=float, default=None,
+                        help='start new output segment every '
+                             'ROTATE_INTERVAL seconds (wall clock aligned)')
+    parser.add_argument('--compress', default=None, choices=('gz', 'xz'),
+                        help='compress closed segments in background')
+    parser.add_argument('--index-every', type=int, default=1000,
+                        help='text output time index entry every '
+                             'INDEX_EVERY samples, 0 = no index')
+    parser.add_argument('--index-interval', type=float, default=60.0,
+                        help='max time (s) between time index entries')
+    parser.add_argument('--aggregates', default=None,
+                        help='comma separated aggregate tiers in seconds '
+                             '(e.g. 1,60,3600), default: off')
+    parser.add_argument('--aggregate-dir', default=None,
+                        help='aggregate files directory (default: save/)')
+    parser.add_argument('--stats-window', type=int, default=1000,
+                        help='number of samples in rolling statistics')
+    parser.add_argument('--stats-interval', type=float, default=10.0,
+                        help='rolling statistics logging interval (s) on '
+                             'stderr, 0 = off (not available for raw format)')
+    args = parser.parse_args(argv)
+    if(args.port is None):
+        args.port = ['/dev/ttyUSB0']
+    return args
+
+
+def openDevice(args, port):
+    """opens multimeter with command line serial parameters
+
+    Arguments:
+        args -> argparse.Namespace
+        port -> serial device path
+
+    Returns:
+        brymen257.Brymen257 object"""
+    device = br.Brymen257(None)
+    device.port = port
+    device.baudrate = args.baudrate
+    device.bytesize = args.bytesize
+    device.parity = PARITIES[args.parity]
+    device.stopbits = args.stopbits
+    device.timeout = args.timeout
+    device.open()
+    return device
+
+
+def openWriter(args, port):
+    """creates output writer for the device
+
+    Arguments:
+        args -> argparse.Namespace
+        port -> serial device path
+
+    Returns:
+        sampleWriter.BatchWriter object"""
+    output = args.output
+    many = len(args.port) > 1
+    rotate = args.rotate_size or args.rotate_interval or args.compress
+    if(args.format is not None):
+        extension = '.' + args.format
+    elif(output is not None and output != '-' and not many):
+        extension = os.path.splitext(output)[1] or '.txt'
+    else:
+        extension = '.txt'
+    if(output == '-'):
+        if(extension != '.txt' or many or rotate):
+            sys.exit('only one text output can be written to stdout '
+                     '(without rotation)')
+        output = '/dev/stdout'
+    elif(output is None or many):
+        saveDir = output or os.path.join(os.getcwd(), 'save')
+        if(not os.path.exists(saveDir)):
+            os.mkdir(saveDir)
+        output = os.path.join(saveDir,
+                              time.strftime("%Y_%m_%d %H_%M_%S",
+                                            time.gmtime()) + ' ' +
+                              os.path.basename(port) + extension)
+    if(rotate):
+        writer = rtn.RotatingWriter(output, smw.writerClass(extension),
+                                    args.rotate_size, args.rotate_interval,
+                                    args.compress,
+                                    flushInterval=args.flush_interval,
+                                    flushCount=args.flush_count)
+    else:
+        writer = smw.writerClass(extension)(output,
+                                            flushInterval=args.flush_interval,
+                                            flushCount=args.flush_count)
+        if(args.index_every and extension in ('.txt', '.runs') and
+           output != '/dev/stdout'):
+            writer = tix.IndexedWriter(writer, args.index_every,
+                                       args.index_interval)
+    recordFilter = None if writer.raw else rcf.createFilter(
+        extension, args.deadband, args.relative_deadband, args.heartbeat)
+    if(recordFilter is not None):
+        writer = rcf.FilteredWriter(writer, recordFilter)
+    return writer
+
+
+def logStats(stats):
+    """prints rolling statistics of every device on stderr
+
+    Arguments:
+        stats -> dict: brymen257.Brymen257 object -> RollingStats object"""
+    for (device, deviceStats) in stats.items():
+        print(time.strftime('%Y-%m-%d %H:%M:%S'), device.port, deviceStats,
+              file=sys.stderr, flush=True)
+
+
+def openAggregator(args, port):
+    """creates aggregates of the device (see --aggregates)
+
+    Arguments:
+        args -> argparse.Namespace
+        port -> serial device path
+
+    Returns:
+        aggregates.Aggregator object"""
+    directory = args.aggregate_dir or os.path.join(os.getcwd(), 'save')
+    if(not os.path.exists(directory)):
+        os.mkdir(directory)
+    tiers = [float(tier) for tier in args.aggregates.split(',')]
+    return agg.Aggregator(os.path.join(directory, 'aggregates ' +
+                                       os.path.basename(port)), tiers)
+
+
+def run(writers, duration=None, count=None, statsWindow=1000,
+        statsInterval=0, aggregators=None):
+    """logging loop : services every device in one event loop, all frames
+    read at once are written in one batch, until duration or count limit
+    (or SIGINT/SIGTERM)
+
+    Arguments:
+        writers  -> dict: brymen257.Brymen257 object -> BatchWriter object
+        duration -> max logging time in seconds (None = no limit)
+        count    -> max number of samples per device (None = no limit)
+        statsWindow   -> number of samples in rolling statistics
+        statsInterval -> statistics logging interval (s), 0 = off
+        aggregators   -> dict: device -> aggregates.Aggregator object
+
+    Returns:
+        tuple: (dict: device -> number of written samples, list of failed
+        devices), failed devices are reported on stderr"""
+    written = dict((device, 0) for device in writers)
+    raw = any(writer.raw for writer in writers.values())
+    stats = {}
+    if(statsInterval and not raw):
+        stats = dict((device, rst.RollingStats(window=statsWindow))
+                     for device in writers)
+    nextStats = [time.monotonic() + statsInterval]
+    reported = [0]                      # number of reported failed devices
+    aggregators = aggregators or {}
+
+    def sink(device, batch):
+        if(count is not None):
+            batch = batch[:count - written[device]]
+        if(stats):
+            update = stats[device].update
+            for sample in batch:
+                update(*sample)
+        if(device in aggregators):
+            aggregators[device].update(batch)
+        writers[device].write(batch)
+        written[device] += len(batch)
+        if(count is not None and written[device] >= count):
+            engine.remove(device)       # limit reached for this device
+
+    def idle():
+        for (device, error) in engine.failed[reported[0]:]:
+            print(time.strftime('%Y-%m-%d %H:%M:%S'), device.port,
+                  'failed:', error, file=sys.stderr, flush=True)
+        reported[0] = len(engine.failed)
+        for writer in writers.values():
+            writer.flushIfDue()         # bounded data loss window
+        if(stats and time.monotonic() >= nextStats[0]):
+            logStats(stats)
+            nextStats[0] += statsInterval
+
+    engine = acq.AcquisitionEngine(sink, raw=raw)
+    for device in writers:
+        engine.add(device)
+    engine.run(duration, idle)
+    return (written, [device for (device, error) in engine.failed])
+
+
+def main(argv=None):
+    """command line entry point"""
+    args = parseArguments(argv)
+    # SIGTERM stops logging the same way as Ctrl+C (file is closed cleanly)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    writers = {}
+    aggregators = {}
+    try:
+        for port in args.port:
+            device = openDevice(args, port)
+            writers[device] = openWriter(args, port)
+            if(args.aggregates):
+                aggregators[device] = openAggregator(args, port)
+        (written, failed) = run(writers, args.duration, args.count,
+                                args.stats_window, args.stats_interval,
+                                aggregators)
+        if(failed):
+            sys.exit('failed devices: ' +
+                     ', '.join(device.port for device in failed))
+    except serial.SerialException as error:
+        sys.exit(str(error))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for aggregator in aggregators.values():
+            aggregator.close()
+        for (device, writer) in writers.items():
+            writer.close()
+            device.close()
+
+
+if __name__ == '__main__':
+    main()
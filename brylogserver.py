@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+headless Brymen 257 streaming server : live samples (or raw frames) of one
+or many multimeters for local clients over TCP and/or UNIX socket
+(see libs/streamServer.py for the protocol)
+"""
+
+import argparse
+import signal
+import sys
+import serial
+import brylogcli
+import libs.streamServer as sts
+
+
+def parseArguments(argv=None):
+    """command line parser
+
+    Arguments:
+        argv -> list of arguments, sys.argv[1:] if None
+
+    Returns:
+        argparse.Namespace"""
+    parser = argparse.ArgumentParser(description='Brymen 257 streaming '
+                                                 'server')
+    brylogcli.addSerialArguments(parser)
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='TCP listening address (default: 127.0.0.1)')
+    parser.add_argument('--tcp-port', type=int, default=2570,
+                        help='TCP listening port, 0 = no TCP server '
+                             '(default: 2570)')
+    parser.add_argument('--unix', default=None,
+                        help='UNIX socket path (default: no UNIX server)')
+    parser.add_argument('--max-buffer', type=int, default=2 ** 22,
+                        help='max buffered bytes per slow client')
+    args = parser.parse_args(argv)
+    if(args.port is None):
+        args.port = ['/dev/ttyUSB0']
+    return args
+
+
+def main(argv=None):
+    """command line entry point"""
+    args = parseArguments(argv)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    devices = []
+    try:
+        for port in args.port:
+            devices.append(brylogcli.openDevice(args, port))
+    except serial.SerialException as error:
+        for device in devices:
+            device.close()
+        sys.exit(str(error))
+    server = sts.StreamServer(devices, args.max_buffer)
+    server.serve(args.host if args.tcp_port else None, args.tcp_port,
+                 args.unix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+selector based acquisition engine for many multimeters in one thread
+"""
+import selectors
+import time
+import serial
+
+
+class AcquisitionEngine(object):
+    """services many Brymen257 devices from one selector event loop.
+    Every device keeps its own frame buffer and decoding state, all
+    decoded batches go to one shared sink"""
+    def __init__(self, sink, raw=False):
+        """Arguments:
+            sink -> callable(device, batch) called from the loop thread
+                    with list of (time, value, unit) samples or
+                    (monotonic ns, raw frame) records if raw
+            raw  -> don't decode frames (see rawCapture)"""
+        self.sink = sink
+        self.raw = raw
+        self.selector = selectors.DefaultSelector()
+        self.devices = []
+        self.failed = []              # (device, error message) of devices
+                                      # removed after I/O failure
+        self.running = False
+
+    def add(self, device):
+        """adds opened device to the engine
+
+        Arguments:
+            device -> brymen257.Brymen257 object"""
+        self.selector.register(device.fileno(), selectors.EVENT_READ, device)
+        self.devices.append(device)
+
+    def remove(self, device):
+        """removes device from the engine (device is not closed)
+
+        Arguments:
+            device -> brymen257.Brymen257 object"""
+        self.devices.remove(device)
+        for key in list(self.selector.get_map().values()):
+            if(key.data is device):
+                self.selector.unregister(key.fileobj)
+
+    def _restart(self, device):
+        """reopens device after real I/O failure, drops it if impossible"""
+        self.remove(device)
+        try:
+            device.restartSerialDevice()
+        except (OSError, serial.SerialException) as error:
+            self.failed.append((device, str(error)))
+            return
+        self.add(device)
+
+    def _batch(self, device):
+        """decodes every complete frame buffered by device
+
+        Returns:
+            list of samples or raw records"""
+        if(self.raw):
+            return [(time.monotonic_ns(), frame)
+                    for frame in device.popFrames()]
+        decodeFrame = device.frameCache.decode
+        batch = [decodeFrame(frame) for frame in device.popFrames()]
+        if(batch):
+            (device.seconds, device.value, device.unit) = batch[-1]
+        return batch
+
+    def poll(self, timeout=None):
+        """one event loop iteration : reads every ready device once
+
+        Arguments:
+            timeout -> max waiting time for data in seconds (None = block)
+
+        Returns:
+            number of samples passed to the sink"""
+        count = 0
+        for (key, events) in self.selector.select(timeout):
+            device = key.data
+            try:
+                device.readChunk()
+            except (OSError, serial.SerialException):
+                self._restart(device)
+                continue
+            batch = self._batch(device)
+            if(batch):
+                self.sink(device, batch)
+                count += len(batch)
+        return count
+
+    def run(self, duration=None, idle=None, timeout=1.0):
+        """event loop, works until stop() call, duration limit or until
+        every device failed
+
+        Arguments:
+            duration -> max working time in seconds (None = no limit)
+            idle     -> callable() called after every iteration (e.g.
+                        periodic writer flushing)
+            timeout  -> max single select waiting time in seconds"""
+        deadline = None if duration is None else time.monotonic() + duration
+        self.running = True
+        while self.running and self.devices:
+            wait = timeout
+            if(deadline is not None):
+                wait = deadline - time.monotonic()
+                if(wait <= 0):
+                    break
+                wait = min(wait, timeout)
+            self.poll(wait)
+            if(idle is not None):
+                idle()
+        self.running = False
+
+    def stop(self):
+        """stops the event loop (may be called from the sink)"""
+        self.running = False
+
+    def close(self):
+        """closes selector and every device"""
+        self.selector.close()
+        for device in self.devices:
+            device.close()
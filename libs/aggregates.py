@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+multi-resolution aggregates (per second, minute, hour, ...) computed
+incrementally during acquisition, one compact file per tier
+
+file layout:
+    header  -> MAGIC (8 bytes) + version (uint16) + record size (uint16) +
+               4 reserved bytes + tier resolution (float64 seconds)
+    records -> fixed width little endian records: float64 bucket start,
+               float64 min, float64 max, float64 mean, uint32 count,
+               uint32 error count, uint8 unit code (see brymen257.UNITS)
+"""
+import glob
+import os
+import struct
+import threading
+import time
+import libs.brymen257 as br
+
+MAGIC = b'BRYAGG\x00\x01'
+VERSION = 1
+HEADER = struct.Struct('<8sHH4xd')
+RECORD = struct.Struct('<ddddIIB')
+TIERS = (1, 60, 3600)
+
+
+def recordType():
+    """returns numpy dtype of the aggregate record"""
+    import numpy as np
+    return np.dtype([('start', '<f8'), ('min', '<f8'), ('max', '<f8'),
+                     ('mean', '<f8'), ('count', '<u4'), ('errors', '<u4'),
+                     ('unit', 'u1')])
+
+
+def readHeader(fo):
+    """checks aggregate file header
+
+    Arguments:
+        fo -> binary file object at position 0
+
+    Returns:
+        (header size, tier resolution)"""
+    header = fo.read(HEADER.size)
+    if(len(header) != HEADER.size):
+        raise ValueError('not an aggregate file (no header)')
+    (magic, version, size, resolution) = HEADER.unpack(header)
+    if(magic != MAGIC or version != VERSION or size != RECORD.size):
+        raise ValueError('not supported aggregate file')
+    return (HEADER.size, resolution)
+
+
+class Tier(object):
+    """one aggregation resolution : current bucket in memory, closed
+    buckets appended to the tier file"""
+    def __init__(self, fileName, resolution, retention=None):
+        """Arguments:
+            fileName   -> tier file path (appended across runs)
+            resolution -> bucket length (s)
+            retention  -> max age (s) of kept records, None = forever"""
+        self.fileName = fileName
+        self.resolution = resolution
+        self.retention = retention
+        self.fo = open(fileName, 'ab')
+        if(self.fo.tell() == 0):
+            self.fo.write(HEADER.pack(MAGIC, VERSION, RECORD.size,
+                                      resolution))
+        self.start = None               # current bucket
+        self.records = 0                # number of closed buckets
+
+    def _reset(self, start, unit):
+        self.start = start
+        self.unit = unit
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def update(self, seconds, value, unit):
+        """adds sample to the current bucket, closes the bucket when the
+        sample belongs to the next one or unit changes
+
+        Arguments:
+            seconds -> sample time
+            value   -> sample value
+            unit    -> sample unit"""
+        start = seconds - seconds % self.resolution
+        if(start != self.start or unit != self.unit):
+            self.close()
+            self._reset(start, unit)
+        if(value == br.ERROR_VALUE):
+            self.errors += 1
+            return
+        if(value < self.minimum):
+            self.minimum = value
+        if(value > self.maximum):
+            self.maximum = value
+        self.sum += value
+        self.count += 1
+
+    def close(self):
+        """writes the current bucket (if any)"""
+        if(self.start is None):
+            return
+        if(self.count):
+            record = (self.start, self.minimum, self.maximum,
+                      self.sum / self.count, self.count, self.errors,
+                      br.UNIT_CODES[self.unit])
+        else:                           # error readings only
+            nan = float('nan')
+            record = (self.start, nan, nan, nan, 0, self.errors,
+                      br.UNIT_CODES[self.unit])
+        self.fo.write(RECORD.pack(*record))
+        self.records += 1
+        self.start = None
+
+    def prune(self, lock, now=None):
+        """removes records older than retention : the tier file is
+        rewritten without holding the lock, only records appended meanwhile
+        are copied under it (the file is reopened)
+
+        Arguments:
+            lock -> lock of the tier updates (Aggregator.lock)
+            now  -> current time, time.time() if None"""
+        if(self.retention is None):
+            return
+        now = time.time() if now is None else now
+        with lock:
+            self.fo.flush()
+            size = os.path.getsize(self.fileName)
+        with open(self.fileName, 'rb') as fi:
+            readHeader(fi)
+            data = fi.read(size - HEADER.size)
+        records = [record for record in RECORD.iter_unpack(data)
+                   if record[0] >= now - self.retention]
+        temporary = self.fileName + '.tmp'
+        fo = open(temporary, 'wb')
+        fo.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.resolution))
+        fo.write(b''.join([RECORD.pack(*record) for record in records]))
+        with lock:
+            self.fo.flush()
+            with open(self.fileName, 'rb') as fi:
+                fi.seek(size)
+                fo.write(fi.read())
+            fo.close()
+            os.replace(temporary, self.fileName)
+            self.fo.close()
+            self.fo = open(self.fileName, 'ab')
+
+
+class Aggregator(object):
+    """keeps every tier of one device, samples are usually passed as
+    sample bus listener (cheap in-memory update, buffered writes),
+    retention runs in background thread"""
+    def __init__(self, baseName, tiers=TIERS, retention=None,
+                 flushInterval=10.0, pruneInterval=3600.0):
+        """Arguments:
+            baseName      -> tier files prefix, files are
+                             '<baseName> <resolution>s.agg'
+            tiers         -> bucket lengths (s)
+            retention     -> dict: resolution -> max age (s) of records
+                             (missing or None = forever)
+            flushInterval -> max time (s) between tier files flushes
+            pruneInterval -> time (s) between retention checks"""
+        retention = retention or {}
+        self.tiers = [Tier('%s %gs.agg' % (baseName, resolution),
+                           resolution, retention.get(resolution))
+                      for resolution in sorted(tiers)]
+        self.flushInterval = flushInterval
+        self.pruneInterval = pruneInterval
+        self.lastFlush = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.stopEvent = threading.Event()
+        self.pruning = None
+        if(any(tier.retention is not None for tier in self.tiers)):
+            self.pruning = threading.Thread(target=self._prune, daemon=True)
+            self.pruning.start()
+
+    def _prune(self):
+        """retention thread, tier files are rewritten every pruneInterval
+        seconds"""
+        while not self.stopEvent.wait(self.pruneInterval):
+            for tier in self.tiers:
+                try:
+                    tier.prune(self.lock)
+                except OSError:
+                    pass                # tried again next time
+
+    def update(self, samples):
+        """adds batch of samples to every tier (sample bus listener)
+
+        Arguments:
+            samples -> list of (time, value, unit) tuples"""
+        if(not samples or len(samples[0]) != 3):
+            return                      # raw capture records
+        with self.lock:
+            if(self.closed):
+                return
+            for tier in self.tiers:
+                update = tier.update
+                for sample in samples:
+                    update(*sample)
+            now = time.monotonic()
+            if(now - self.lastFlush >= self.flushInterval):
+                self.lastFlush = now
+                for tier in self.tiers:
+                    tier.fo.flush()
+
+    def close(self):
+        """writes current buckets, applies retention and closes tier
+        files"""
+        with self.lock:
+            if(self.closed):
+                return
+            self.closed = True
+            for tier in self.tiers:
+                tier.close()
+        self.stopEvent.set()
+        if(self.pruning is not None):
+            self.pruning.join()
+        for tier in self.tiers:
+            tier.prune(self.lock)
+            tier.fo.close()
+
+
+def readRecords(fileName, codes=False):
+    """reads aggregate file
+
+    Arguments:
+        fileName -> tier file path
+        codes    -> return unit codes instead of unit strings
+
+    Returns:
+        list of (start, min, max, mean, count, errors, unit) tuples"""
+    with open(fileName, 'rb') as fo:
+        readHeader(fo)
+        data = fo.read()
+    data = data[:len(data) - len(data) % RECORD.size]
+    records = list(RECORD.iter_unpack(data))
+    if(codes):
+        return records
+    units = br.UNITS
+    return [record[:6] + (units[record[6]],) for record in records]
+
+
+def load(fileName):
+    """maps aggregate file into memory without parsing
+
+    Arguments:
+        fileName -> tier file path
+
+    Returns:
+        numpy.memmap structured array (see recordType)"""
+    import numpy as np
+    with open(fileName, 'rb') as fo:
+        (offset, resolution) = readHeader(fo)
+    count = (os.path.getsize(fileName) - offset) // RECORD.size
+    if(count == 0):
+        return np.zeros(0, dtype=recordType())
+    return np.memmap(fileName, dtype=recordType(), mode='r', offset=offset,
+                     shape=(count,))
+
+
+def pruneFiles(directory, maxAge, patterns=('*.txt', '*.bin', '*.raw',
+                                            '*.runs', '*.gz', '*.xz',
+                                            '*.idx')):
+    """raw data retention (independent of aggregate retention) : removes
+    saved files not modified for maxAge seconds, aggregate files are
+    never removed
+
+    Arguments:
+        directory -> saved files directory
+        maxAge    -> max file age (s)
+        patterns  -> glob patterns of raw data files
+
+    Returns:
+        list of removed file paths"""
+    limit = time.time() - maxAge
+    removed = []
+    for pattern in patterns:
+        for fileName in glob.glob(os.path.join(directory, pattern)):
+            if(os.path.getmtime(fileName) < limit):
+                os.remove(fileName)
+                removed.append(fileName)
+    return removed
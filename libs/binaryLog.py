@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+compact binary log format for saved samples
+
+file layout:
+    header  -> MAGIC (8 bytes) + version (uint16) + record size (uint16) +
+               4 reserved bytes
+    records -> fixed width little endian records:
+               float64 time, float64 value, uint8 unit code (see UNITS)
+"""
+import struct
+import os
+import libs.brymen257 as br
+import libs.sampleWriter as smw
+
+MAGIC = b'BRYLOG\x00\x01'
+VERSION = 1
+HEADER = struct.Struct('<8sHH4x')
+RECORD = struct.Struct('<ddB')
+
+
+def recordType():
+    """returns numpy dtype of the binary record"""
+    import numpy as np
+    return np.dtype([('seconds', '<f8'), ('value', '<f8'), ('unit', 'u1')])
+
+
+def readHeader(fo):
+    """checks binary log header
+
+    Arguments:
+        fo -> binary file object at position 0
+
+    Returns:
+        header size (records offset)"""
+    header = fo.read(HEADER.size)
+    if(len(header) != HEADER.size):
+        raise ValueError('not a binary log file (no header)')
+    (magic, version, size) = HEADER.unpack(header)
+    if(magic != MAGIC or version != VERSION or size != RECORD.size):
+        raise ValueError('not supported binary log file')
+    return HEADER.size
+
+
+class BinaryWriter(smw.BatchWriter):
+    """writes (time, value, unit) samples as fixed width binary records"""
+    mode = 'ab'
+
+    def __init__(self, fileName, **rest):
+        """Arguments:
+            fileName -> output file path
+            **rest   -> BatchWriter flush arguments"""
+        smw.BatchWriter.__init__(self, fileName, **rest)
+        if(self.fo.tell() == 0):
+            self.fo.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def _format(self, samples):
+        """formats batch of samples
+
+        Arguments:
+            samples -> list of (time, value, unit) tuples
+
+        Returns:
+            bytes with one record per sample"""
+        pack = RECORD.pack
+        codes = br.UNIT_CODES
+        return b''.join([pack(t, v, codes[u]) for (t, v, u) in samples])
+
+
+def load(fileName):
+    """maps binary log file into memory without parsing
+
+    Arguments:
+        fileName -> binary log file path
+
+    Returns:
+        numpy.memmap structured array with seconds, value, unit fields"""
+    import numpy as np
+    with open(fileName, 'rb') as fo:
+        offset = readHeader(fo)
+    count = (os.path.getsize(fileName) - offset) // RECORD.size
+    if(count == 0):
+        return np.zeros(0, dtype=recordType())
+    return np.memmap(fileName, dtype=recordType(), mode='r', offset=offset,
+                     shape=(count,))
+
+
+def readRecords(fileName):
+    """reads binary log file without numpy
+
+    Arguments:
+        fileName -> binary log file path
+
+    Returns:
+        generator of (time, value, unit) tuples"""
+    with open(fileName, 'rb') as fo:
+        readHeader(fo)
+        data = fo.read(RECORD.size * 4096)
+        while len(data) >= RECORD.size:
+            whole = len(data) - len(data) % RECORD.size
+            for (t, v, u) in RECORD.iter_unpack(data[:whole]):
+                if(v == br.ERROR_VALUE):    # written as int by _saving
+                    v = br.ERROR_VALUE
+                yield (t, v, br.UNITS[u])
+            data = data[whole:] + fo.read(RECORD.size * 4096)
+
+
+def textToBinary(textName, binaryName):
+    """converts text log (time\tvalue\tunit\t) into binary log
+
+    Arguments:
+        textName   -> source text log file path
+        binaryName -> destination binary log file path
+
+    Returns:
+        number of converted samples"""
+    writer = BinaryWriter(binaryName)
+    count = 0
+    with open(textName, 'r') as fi:
+        batch = []
+        for line in fi:
+            fields = line.split('\t')
+            batch.append((float(fields[0]), float(fields[1]), fields[2]))
+            if(len(batch) >= writer.batchSize):
+                writer.write(batch)
+                count += len(batch)
+                batch = []
+        writer.write(batch)
+        count += len(batch)
+    writer.close()
+    return count
+
+
+def binaryToText(binaryName, textName):
+    """converts binary log into text log (time\tvalue\tunit\t)
+
+    Arguments:
+        binaryName -> source binary log file path
+        textName   -> destination text log file path
+
+    Returns:
+        number of converted samples"""
+    writer = smw.BatchWriter(textName)
+    count = 0
+    batch = []
+    for sample in readRecords(binaryName):
+        batch.append(sample)
+        if(len(batch) >= writer.batchSize):
+            writer.write(batch)
+            count += len(batch)
+            batch = []
+    writer.write(batch)
+    count += len(batch)
+    writer.close()
+    return count
+
+
+if __name__ == '__main__':
+    import sys
+    if(len(sys.argv) != 3):
+        sys.exit('usage: python -m libs.binaryLog SOURCE DESTINATION\n'
+                 '(.bin <-> .txt conversion)')
+    if(sys.argv[1].endswith('.bin')):
+        print(binaryToText(sys.argv[1], sys.argv[2]), 'samples converted')
+    else:
+        print(textToBinary(sys.argv[1], sys.argv[2]), 'samples converted')
@@ -2,6 +2,9 @@
 # encoding: utf-8
 import time
 import sys
+import os
+import select
+import collections
 import serial
 
 
@@ -41,11 +44,376 @@ digits = {('111', '1011'): '0', ('000', '0000'): '0',
           ('111', '0001'): ' '}     # for temperature measuring
 
 
+Sample = collections.namedtuple('Sample', ('seconds', 'value', 'unit'))
+Sample.__doc__ = """decoded multimeter reading, same layout as getData()"""
+
+
+def _digitTable():
+    """builds integer digit lookup table from digits dictionary
+
+    Returns:
+        128 elements tuple indexed by ((firstByte >> 1) & 7) << 4 |
+        (secondByte & 15), values: 0-9 digit, BLANK or ERROR code"""
+    table = [ERROR] * 128
+    for (bits1, bits2), char in digits.items():
+        index = (int(bits1, 2) << 4) | int(bits2, 2)
+        table[index] = BLANK if char == ' ' else int(char)
+    return tuple(table)
+
+ERROR_VALUE = -1000         # value of lcd error readings (see _setFrame)
+BLANK = -1                  # ' ' digit (temperature measuring)
+ERROR = -2                  # 'R' digit (various error codes)
+DIGITS = _digitTable()
+
+# period position bits -> number of decimal places (byte index, decimals)
+PERIOD = ((5, 3), (7, 2), (9, 1))
+
+
+def _frameDigits(dataFrame):
+    """returns four decoded digits of the raw frame (see DIGITS table)"""
+    return (DIGITS[((dataFrame[3] & 0x0e) << 3) | (dataFrame[4] & 0x0f)],
+            DIGITS[((dataFrame[5] & 0x0e) << 3) | (dataFrame[6] & 0x0f)],
+            DIGITS[((dataFrame[7] & 0x0e) << 3) | (dataFrame[8] & 0x0f)],
+            DIGITS[((dataFrame[9] & 0x0e) << 3) | (dataFrame[10] & 0x0f)])
+
+
+def _framePrefix(dataFrame):
+    """returns sci prefix of the raw frame (see Brymen257._prefix)"""
+    if(dataFrame[11] & 0x02):
+        return 'M'
+    if(dataFrame[11] & 0x01):
+        return 'k'
+    if(dataFrame[12] & 0x01):
+        return 'n'
+    if(dataFrame[13] & 0x02):
+        return 'u'
+    if(dataFrame[13] & 0x01):
+        return 'm'
+    return ' '
+
+
+def _frameUnit(dataFrame):
+    """returns current type + physical quantity of the raw frame
+    (see Brymen257._currentType and Brymen257._names)"""
+    if(dataFrame[1] & 0x04):
+        unit = '='
+    elif(dataFrame[1] & 0x02):
+        unit = '~'
+    else:
+        unit = ' '
+    if(dataFrame[12] & 0x04):
+        return unit + 'O'
+    if(dataFrame[12] & 0x02):
+        return unit + 'H'
+    if(dataFrame[13] & 0x04):
+        return unit + 'F'
+    if(dataFrame[14] & 0x04):
+        return unit + 'V'
+    if(dataFrame[14] & 0x02):
+        return unit + 'A'
+    return unit + ' '
+
+
+def decode_frame(dataFrame, seconds=None):
+    """decodes raw data frame without Brymen257 object and string bit
+    conversions, output is the same as Brymen257._setFrame
+    (frames without period are decoded as integers and temperature frames
+    with lcd error digits get ERROR_VALUE, _setFrame fails on them)
+
+    Arguments:
+        dataFrame -> 15 bytes raw data frame from multimeter
+        seconds   -> timebase of the frame, time.time() if None
+
+    Returns:
+        Sample(seconds, value, unit)"""
+    if(seconds is None):
+        seconds = time.time()
+    d1, d2, d3, d4 = _frameDigits(dataFrame)
+    negative = dataFrame[3] & 0x01
+    if(d4 == BLANK):                     # temperature special code
+        if(min(d1, d2, d3) >= 0):
+            value = float(d1 * 100 + d2 * 10 + d3)
+            return Sample(seconds, -value if negative else value, 'C')
+        try:
+            return Sample(seconds, float(_frameString(dataFrame)), 'C')
+        except ValueError:
+            return Sample(seconds, ERROR_VALUE, 'C')
+    unit = _frameUnit(dataFrame)
+    if(min(d1, d2, d3, d4) < 0):
+        # rare lcd error values, decode them exactly as _setFrame does
+        characters = _frameString(dataFrame)
+        for (byte, decimals) in PERIOD:
+            if(dataFrame[byte] & 0x01):
+                characters = characters[:-decimals] + '.' + \
+                    characters[-decimals:]
+                break
+        try:
+            value = float(characters[1:7])
+        except ValueError:
+            return Sample(seconds, ERROR_VALUE, unit)
+        return Sample(seconds, value * multiplier[_framePrefix(dataFrame)],
+                      unit)
+    # sign is not applied to measurements (the same as in _setFrame)
+    value = d1 * 1000 + d2 * 100 + d3 * 10 + d4
+    for (byte, decimals) in PERIOD:
+        if(dataFrame[byte] & 0x01):
+            value = value / 10 ** decimals  # correctly rounded, like float()
+            break
+    else:
+        value = float(value)
+    return Sample(seconds, value * multiplier[_framePrefix(dataFrame)], unit)
+
+
+def _frameString(dataFrame):
+    """returns sign + digits string of the raw frame (slow path only)"""
+    characters = '-' if dataFrame[3] & 0x01 else '+'
+    for digit in _frameDigits(dataFrame):
+        characters += '0123456789R '[digit]
+    return characters
+
+
+# unit codes : index of unit string in UNITS tuple (compact unit storage)
+UNITS = tuple(c + n for c in '=~ ' for n in ' OHFVA') + ('C',)
+UNIT_CODES = dict((unit, code) for (code, unit) in enumerate(UNITS))
+
+FRAME_SIZE = 15             # magic number of bytes in brymen257 frame
+CHUNK_FRAMES = 2 ** 16      # frames decoded at once by decode_frames
+
+
+def _decodeChunk(frames, values, units):
+    """decode_frames worker : decodes chunk of frames into output slices,
+    bit work is done on uint8 columns, only digit table indices are widened
+
+    Arguments:
+        frames -> (n, 15) numpy uint8 array (view of the input buffer)
+        values -> n elements float64 output slice
+        units  -> n elements uint8 output slice
+
+    Returns:
+        boolean numpy array, frames left for the scalar decoder"""
+    import numpy as np
+    table = np.array(DIGITS, dtype=np.int8)
+    d = [table[((frames[:, 2 * i + 1] & 0x0e).astype(np.intp) << 3) |
+               (frames[:, 2 * i + 2] & 0x0f)] for i in range(1, 5)]
+    # current type and quantity -> unit code (priorities as in _frameUnit)
+    current = np.select([frames[:, 1] & 0x04 != 0, frames[:, 1] & 0x02 != 0],
+                        [np.uint8(0), np.uint8(1)], np.uint8(2))
+    name = np.select([frames[:, 12] & 0x04 != 0, frames[:, 12] & 0x02 != 0,
+                      frames[:, 13] & 0x04 != 0, frames[:, 14] & 0x04 != 0,
+                      frames[:, 14] & 0x02 != 0],
+                     [np.uint8(code) for code in range(1, 6)], np.uint8(0))
+    units[:] = current * 6 + name
+    prefix = np.select([frames[:, 11] & 0x02 != 0, frames[:, 11] & 0x01 != 0,
+                        frames[:, 12] & 0x01 != 0, frames[:, 13] & 0x02 != 0,
+                        frames[:, 13] & 0x01 != 0],
+                       [multiplier['M'], multiplier['k'], multiplier['n'],
+                        multiplier['u'], multiplier['m']], multiplier[' '])
+    decimals = np.select([frames[:, byte] & 0x01 != 0
+                          for (byte, dec) in PERIOD],
+                         [dec for (byte, dec) in PERIOD], 0)
+    number = (d[0] * np.int16(1000) + d[1] * np.int16(100) +
+              d[2] * np.int16(10) + d[3])
+    values[:] = (number / 10.0 ** decimals) * prefix
+    # temperature special code
+    temperature = d[3] == BLANK
+    degrees = (d[0] * np.int16(100) + d[1] * np.int16(10) +
+               d[2]).astype(np.float64)
+    degrees = np.where(frames[:, 3] & 0x01 != 0, -degrees, degrees)
+    values[temperature] = degrees[temperature]
+    units[temperature] = UNIT_CODES['C']
+    # rare lcd error values -> scalar decoder
+    slow = np.minimum(np.minimum(d[0], d[1]), d[2]) < 0
+    slow |= ~temperature & (d[3] < 0)
+    return slow
+
+
+def decode_frames(buffer, seconds=None):
+    """vectorized decode_frame for many raw data frames at once (decoded in
+    CHUNK_FRAMES chunks, so temporary arrays don't grow with the buffer)
+
+    Arguments:
+        buffer  -> N*15 raw bytes (bytes, memoryview or numpy uint8 array)
+        seconds -> N timebases of the frames (or one for all), time.time()
+                   if None
+
+    Returns:
+        tuple of numpy arrays: (seconds, values, unit codes) where unit code
+        is UNITS index, lcd error readings have -1000 value (ERROR_VALUE)"""
+    import numpy as np
+    frames = np.frombuffer(buffer, dtype=np.uint8) \
+        if not isinstance(buffer, np.ndarray) else buffer.astype(np.uint8,
+                                                                 copy=False)
+    if(frames.size % FRAME_SIZE):
+        raise ValueError('buffer size is not multiple of frame size')
+    frames = frames.reshape(-1, FRAME_SIZE)  # view of the buffer if possible
+    count = frames.shape[0]
+    if(seconds is None):
+        seconds = time.time()
+    seconds = np.broadcast_to(np.asarray(seconds, dtype=np.float64),
+                              (count,)).copy()
+    values = np.empty(count, dtype=np.float64)
+    units = np.empty(count, dtype=np.uint8)
+    for first in range(0, count, CHUNK_FRAMES):
+        last = min(first + CHUNK_FRAMES, count)
+        slow = _decodeChunk(frames[first:last], values[first:last],
+                            units[first:last])
+        for row in np.flatnonzero(slow) + first:
+            sample = decode_frame(frames[row].tobytes(), seconds[row])
+            values[row] = sample.value
+            units[row] = UNIT_CODES[sample.unit]
+    return (seconds, values, units)
+
+
+def isAligned(buffer, start=0):
+    """checks brymen257 frame boundary: header nibble 0000 on byte 0 and
+    trailer nibble 1110 on byte 14
+
+    Arguments:
+        buffer -> raw bytes buffer
+        start  -> index of the first frame byte in the buffer
+
+    Returns:
+        boolean"""
+    return (buffer[start] & 0xf0 == 0x00 and
+            buffer[start + FRAME_SIZE - 1] & 0xf0 == 0xe0)
+
+
+class FrameCache(object):
+    """bounded LRU cache of decoded frames : raw frame -> (value, unit),
+    byte-identical frames of stable reading are decoded only once"""
+    def __init__(self, size=256):
+        """Arguments:
+            size -> max number of cached frames (0 = caching off)"""
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, dataFrame):
+        """returns cached (value, unit) of the raw frame or None
+
+        Arguments:
+            dataFrame -> 15 bytes raw data frame (bytes)"""
+        entry = self.entries.get(dataFrame)
+        if(entry is None):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(dataFrame)
+        self.hits += 1
+        return entry
+
+    def put(self, dataFrame, value, unit):
+        """stores decoded frame, drops the least recently used one if full
+
+        Arguments:
+            dataFrame -> 15 bytes raw data frame (bytes)
+            value     -> decoded value
+            unit      -> decoded unit"""
+        if(self.size <= 0):
+            return
+        self.entries[dataFrame] = (value, unit)
+        if(len(self.entries) > self.size):
+            self.entries.popitem(last=False)
+
+    def decode(self, dataFrame, seconds=None):
+        """decode_frame through the cache
+
+        Arguments:
+            dataFrame -> 15 bytes raw data frame (bytes)
+            seconds   -> timebase of the frame, time.time() if None
+
+        Returns:
+            Sample(seconds, value, unit)"""
+        entry = self.entries.get(dataFrame)
+        if(entry is None):
+            self.misses += 1
+            sample = decode_frame(dataFrame, seconds)
+            self.put(dataFrame, sample.value, sample.unit)
+            return sample
+        self.entries.move_to_end(dataFrame)
+        self.hits += 1
+        return Sample(time.time() if seconds is None else seconds, *entry)
+
+    def clear(self):
+        """drops every cached frame (counters are kept)"""
+        self.entries.clear()
+
+
+class FrameBuffer(object):
+    """byte stream ring buffer which slides over misaligned bytes until
+    real brymen257 frame boundary is found (resynchronization)"""
+    def __init__(self, size=4096):
+        """Arguments:
+            size -> max number of buffered bytes (oldest ones are dropped)"""
+        self.size = size
+        self.buffer = bytearray()
+        self.start = 0               # first unread byte in self.buffer
+        self.aligned = True
+        self.resyncs = 0             # number of frame boundary losses
+        self.droppedBytes = 0        # bytes skipped while resynchronizing
+        self.frames = 0              # number of aligned frames
+
+    def __len__(self):
+        return len(self.buffer) - self.start
+
+    def clear(self):
+        """drops all buffered bytes (e.g. after port reopening)"""
+        del self.buffer[:]
+        self.start = 0
+
+    def missing(self):
+        """returns number of bytes needed to complete the next frame"""
+        return max(FRAME_SIZE - len(self), 1)
+
+    def feed(self, data):
+        """appends raw bytes read from serial device
+
+        Arguments:
+            data -> bytes like object"""
+        if(self.start >= self.size):     # reuse consumed space
+            del self.buffer[:self.start]
+            self.start = 0
+        self.buffer += data
+        overflow = len(self) - self.size
+        if(overflow > 0):
+            self.start += overflow
+            self.droppedBytes += overflow
+
+    def popFrame(self):
+        """returns next aligned frame (skipping misaligned bytes)
+
+        Returns:
+            15 bytes raw data frame or None if there is no complete frame"""
+        buf = self.buffer
+        start = self.start
+        end = len(buf) - FRAME_SIZE
+        while start <= end:
+            if(isAligned(buf, start)):
+                self.start = start + FRAME_SIZE
+                self.aligned = True
+                self.frames += 1
+                return bytes(buf[start:self.start])
+            if(self.aligned):
+                self.aligned = False
+                self.resyncs += 1
+            start += 1
+            self.droppedBytes += 1
+        self.start = start
+        return None
+
+
 class Brymen257(serial.Serial):
     """Brymen 257 multimeter class"""
-    def __init__(self, port):
+    def __init__(self, port, cacheSize=256):
         """Arguments:
-            port ->(string) linux port id"""
+            port ->(string) linux port id
+            cacheSize -> number of cached decoded frames (0 = off)"""
+        self.frameBuffer = FrameBuffer()
+        self.frameCache = FrameCache(cacheSize)
+        self.chunk = bytearray(1024)     # reusable buffer for readFrames
         serial.Serial.__init__(self, port=port, baudrate=9600,
                                bytesize=serial.EIGHTBITS,
                                parity=serial.PARITY_NONE,
@@ -54,6 +422,7 @@ class Brymen257(serial.Serial):
         self.unit = ' '
         self.seconds = 0.00
         self.port = port
+        self.restarts = 0                # number of port restarts
 
     def _setFrame(self, dataFrame):
         """populates internal data buffers"""
@@ -65,7 +434,10 @@ class Brymen257(serial.Serial):
             characters += self._giveDigit(dataFrame, 2 * i + 1, 2 * i + 2)
         if(characters[-1] == ' '):       # temperature special code
             self.unit = 'C'
-            self.value = float(characters)
+            try:
+                self.value = float(characters)
+            except ValueError:           # lcd error digits
+                self.value = (-1000)
         else:
             characters = self._period(dataFrame, characters)
             try:                         # multimeter lcd error values handling
@@ -76,19 +448,87 @@ class Brymen257(serial.Serial):
                 self.value *= multiplier[self._prefix(dataFrame)]
             self.unit += self._names(dataFrame)
 
+    def open(self):
+        """opens serial device and drops stale buffered bytes"""
+        self.frameBuffer.clear()
+        serial.Serial.open(self)
+
     def getFrame(self):
-        """returns raw data frame and triggers its processing
+        """returns raw data frame and triggers its processing,
+        misaligned bytes are skipped by self.frameBuffer
 
         Arguments:
 
         Returns:
-            raw data frame from multimeter"""
-        rawData = self.read(15)      # magic number of read bytes for brymen257
-        if(self._isOK(rawData)):
-            self._setFrame(rawData)
-            return rawData           # for further checks in higher classes
-        else:
+            raw data frame from multimeter or None (timeout, I/O error)"""
+        try:
+            rawData = self.frameBuffer.popFrame()
+            while rawData is None:
+                data = self.read(self.frameBuffer.missing())
+                if(not data):        # timeout
+                    return None
+                self.frameBuffer.feed(data)
+                rawData = self.frameBuffer.popFrame()
+        except serial.SerialException:
+            self.restartSerialDevice()  # real I/O failure only
             return None
+        entry = self.frameCache.get(rawData)
+        if(entry is None):
+            self._setFrame(rawData)
+            self.frameCache.put(rawData, self.value, self.unit)
+        else:                        # the same frame as one of the last ones
+            self.seconds = time.time()
+            (self.value, self.unit) = entry
+        return rawData               # for further checks in higher classes
+
+    def readChunk(self):
+        """reads all bytes available now into self.frameBuffer (one readv
+        call into reusable buffer, device must be ready for reading)"""
+        count = os.readv(self.fileno(), (self.chunk,))
+        if(not count):
+            raise serial.SerialException('device disconnected')
+        self.frameBuffer.feed(memoryview(self.chunk)[:count])
+
+    def popFrames(self):
+        """yields every complete frame buffered in self.frameBuffer"""
+        rawData = self.frameBuffer.popFrame()
+        while rawData is not None:
+            yield rawData
+            rawData = self.frameBuffer.popFrame()
+
+    def readFrames(self, wait=None):
+        """reads all available bytes in one chunk (waits for them at most
+        wait seconds using select) and yields every complete frame
+
+        Arguments:
+            wait -> max waiting time for data in seconds, self.timeout
+                    if None
+
+        Returns:
+            generator of raw data frames"""
+        if(wait is None):
+            wait = self.timeout
+        try:
+            if(select.select((self.fileno(),), (), (), wait)[0]):
+                self.readChunk()
+        except (OSError, serial.SerialException):
+            self.restartSerialDevice()  # real I/O failure only
+            return
+        for rawData in self.popFrames():
+            yield rawData
+
+    def readData(self, wait=None):
+        """chunked version of getData, decodes every frame available now
+
+        Arguments:
+            wait -> max waiting time for data in seconds (see readFrames)
+
+        Returns:
+            generator of tuples: (timebase, value, unit)"""
+        for rawData in self.readFrames(wait):
+            (self.seconds, self.value,
+             self.unit) = self.frameCache.decode(rawData)
+            yield (self.seconds, self.value, self.unit)
 
     def getData(self):
         """returns output buffer values
@@ -217,8 +657,9 @@ class Brymen257(serial.Serial):
 
     def restartSerialDevice(self):
         """restarts connection with brymen"""
+        self.restarts += 1
         serial.Serial.close(self)
-        serial.Serial.open(self)
+        self.open()
         time.sleep(0.2)
 
     def _isOK(self, dataFrame):
@@ -229,16 +670,9 @@ class Brymen257(serial.Serial):
 
         Returns:
             boolean"""
-        if(len(dataFrame) != 15):
-            self.restartSerialDevice()
-            return False
-        first = binBit(dataFrame[0])[:4]
-        last = binBit(dataFrame[14])[:4]
-        if(first == '0000' and last == '1110'):
-            return True
-        else:
-            self.restartSerialDevice()
+        if(len(dataFrame) != FRAME_SIZE):
             return False
+        return isAligned(dataFrame)
 
 if __name__ == "__main__":
     device = '/dev/ttyUSB0'
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+long plot history in preallocated numpy ring buffers
+with min/max per pixel decimation
+"""
+import numpy as np
+
+
+class History(object):
+    """ring buffer of (time, value) samples. Every block of samples keeps
+    its min/max, so decimation of long history costs O(size / block)
+    instead of O(size)"""
+    def __init__(self, size, block=256):
+        """Arguments:
+            size  -> max number of kept samples (rounded up to whole blocks)
+            block -> number of samples aggregated in one min/max block"""
+        self.block = block
+        self.blocks = max(-(-size // block), 2)
+        self.size = self.blocks * block
+        self.times = np.zeros(self.size)
+        self.values = np.zeros(self.size)
+        self.blockMin = np.zeros(self.blocks)
+        self.blockMax = np.zeros(self.blocks)
+        self.count = 0                  # number of samples ever appended
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, seconds, value):
+        """adds new sample (the oldest one is dropped if buffer is full)
+
+        Arguments:
+            seconds -> sample time
+            value   -> sample value"""
+        position = self.count % self.size
+        self.times[position] = seconds
+        self.values[position] = value
+        b = position // self.block
+        if(position % self.block == 0):     # new block
+            self.blockMin[b] = value
+            self.blockMax[b] = value
+        elif(value < self.blockMin[b]):
+            self.blockMin[b] = value
+        elif(value > self.blockMax[b]):
+            self.blockMax[b] = value
+        self.count += 1
+
+    def clear(self):
+        """drops every sample"""
+        self.count = 0
+
+    def latest(self, count):
+        """returns newest samples in time order
+
+        Arguments:
+            count -> max number of samples
+
+        Returns:
+            (times, values) numpy arrays"""
+        count = min(count, len(self))
+        index = np.arange(self.count - count, self.count) % self.size
+        return (self.times[index], self.values[index])
+
+    def _units(self, count):
+        """splits newest count samples into whole blocks and single samples
+        of the partial blocks at both ends (the oldest, partially
+        overwritten one shares its slot with the newest one, so their
+        block min/max can't be used)
+
+        Arguments:
+            count -> number of samples (at least one block)
+
+        Returns:
+            (times, mins, maxs, starts) numpy arrays, starts are sample
+            indexes (0 = the oldest) of the units"""
+        first = self.count - count      # absolute index of the oldest one
+        head = -(-first // self.block) * self.block
+        tail = self.count // self.block * self.block
+        headIndex = np.arange(first, head) % self.size
+        tailIndex = np.arange(tail, self.count) % self.size
+        order = np.arange(head // self.block, tail // self.block) % \
+            self.blocks
+        times = np.concatenate((self.times[headIndex],
+                                self.times[order * self.block],
+                                self.times[tailIndex]))
+        mins = np.concatenate((self.values[headIndex], self.blockMin[order],
+                               self.values[tailIndex]))
+        maxs = np.concatenate((self.values[headIndex], self.blockMax[order],
+                               self.values[tailIndex]))
+        starts = np.concatenate((np.arange(first, head),
+                                 np.arange(head, tail, self.block),
+                                 np.arange(tail, self.count))) - first
+        return (times, mins, maxs, starts)
+
+    def decimate(self, width):
+        """min/max decimation of whole history for width pixels wide plot,
+        every pixel gets its min and max, so transients stay visible
+
+        Arguments:
+            width -> number of pixels (bins)
+
+        Returns:
+            (times, values) numpy arrays with at most 2 * width points"""
+        width = max(int(width), 1)
+        count = len(self)
+        if(count <= 2 * width):
+            return self.latest(count)
+        if(count // self.block >= width):
+            # block min/max, O(count / block + block)
+            (times, mins, maxs, starts) = self._units(count)
+        else:
+            (times, mins) = self.latest(count)
+            maxs = mins
+            starts = np.arange(count)
+        # pixel bins of equal number of samples
+        edges = np.unique(np.searchsorted(
+            starts, np.linspace(0, count, width, endpoint=False),
+            'right') - 1)
+        mins = np.minimum.reduceat(mins, edges)
+        maxs = np.maximum.reduceat(maxs, edges)
+        times = np.repeat(times[edges], 2)
+        return (times, np.column_stack((mins, maxs)).ravel())
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""
+fast numpy loader of saved text logs (time\tvalue\tunit\t lines of
+ConfigFrame._saving and brylogcli, rotated .gz/.xz segments too)
+
+files are read in chunks of complete lines, every chunk is parsed at
+once : line structure and unit codes are checked with array operations
+on raw bytes, then digits of both numeric columns are converted by
+integer arithmetic on the bytes (see parseNumbers), float() is used only
+for rare fields (e.g. 17 digits mantissa with exponent). Chunks with
+broken lines (e.g. partial line of interrupted logging) or not finite
+numbers fall back to line by line parsing, such lines are skipped.
+"""
+import math
+import libs.brymen257 as br
+import libs.rotation as rtn
+import libs.timeIndex as tix
+
+CHUNK_SIZE = 2 ** 18        # bytes read and parsed at once (~6k lines)
+UNKNOWN = 255               # code of units missing in brymen257.UNITS
+WIDTH = 24                  # bytes of vectorized number conversion row
+SIGNIFICANT = 18            # max digits of vectorized conversion
+# not digit bytes counts and columns in sums of byteWeights (bit fields)
+(PERIOD, SIGN, MARK, OTHER) = (1, 2 ** 5, 2 ** 10, 2 ** 15)
+(MARK_SHIFT, PERIOD_SHIFT) = (20, 25)
+(MARK_COLUMN, PERIOD_COLUMN) = (2 ** MARK_SHIFT, 2 ** PERIOD_SHIFT)
+# (mask, multiplier, shift) steps : 8 digit bytes -> 4 -> 2 -> 1 number
+SWAR = ((0x0f0f0f0f0f0f0f0f, 10 * 2 ** 8 + 1, 8),
+        (0x00ff00ff00ff00ff, 100 * 2 ** 16 + 1, 16),
+        (0x0000ffff0000ffff, 10000 * 2 ** 32 + 1, 32))
+
+
+def unitTable():
+    """returns lookup table : unit bytes (little endian uint16, 'C' padded
+    with zero byte) -> unit code (brymen257.UNITS index)"""
+    import numpy as np
+    table = np.full(2 ** 16, UNKNOWN, dtype=np.uint8)
+    for (code, unit) in enumerate(br.UNITS):
+        key = unit.encode().ljust(2, b'\x00')
+        table[key[0] | key[1] << 8] = code
+    return table
+
+
+def _nearest(mantissa, decimals):
+    """exact conversion of long fixed point numbers (e.g. 17 digits time
+    stamps) : approximation is moved to the neighbour float until integer
+    comparison of the remainders proves it's the nearest one
+
+    Arguments:
+        mantissa -> int64 numpy array of digits without period
+        decimals -> numpy array of numbers of decimal places (<= 18)
+
+    Returns:
+        tuple of numpy arrays: (converted, float64 values), not converted
+        values are wrong"""
+    import numpy as np
+    tens = (10 ** np.arange(SIGNIFICANT + 1, dtype=np.int64))[decimals]
+    bits = np.array([(10 ** q).bit_length()
+                     for q in range(SIGNIFICANT + 1)])[decimals]
+    whole = mantissa // tens
+    part = mantissa - whole * tens
+    values = whole.astype(np.float64) + part / tens.astype(np.float64)
+    usable = whole < 2 ** 53
+
+    def offset(values):
+        """returns (checked, too small, too big) values masks"""
+        (fraction, exponent) = np.frexp(values)
+        power = fraction == 0.5         # lower neighbour is closer
+        scale = 53 - exponent + power   # half gaps are 2 ** -scale units
+        checked = usable & (scale >= 0) & (scale + bits <= 61)
+        scale = np.where(checked, scale, 0)
+        rest = np.ldexp(values - whole, scale).astype(np.int64)  # exact
+        # 2 * (number - value) * tens * 2 ** scale vs half gaps
+        twice = 2 * ((part << scale) - rest * tens)
+        upper = np.where(power, 2 * tens, tens)
+        odd = np.ldexp(fraction, 53).astype(np.int64) & 1 == 1
+        small = checked & ((twice > upper) | ((twice == upper) & odd))
+        big = checked & ((twice < -tens) | ((twice == -tens) & odd))
+        return (checked, small, big)
+
+    for step in range(3):               # approximation error is <= 1 ulp
+        (checked, small, big) = offset(values)
+        if(not np.any(small | big)):
+            break
+        values = np.where(small, np.nextafter(values, np.inf),
+                          np.where(big, np.nextafter(values, -np.inf),
+                                   values))
+    else:
+        (checked, small, big) = offset(values)
+    return (checked & ~small & ~big, values)
+
+
+def byteWeights():
+    """returns lookup table : (not digit byte, column) -> bincount weight,
+    sums of the weights are numbers of periods, signs, exponent marks and
+    other bytes of the field and columns of the mark and the period"""
+    import numpy as np
+    columns = np.arange(WIDTH)
+    table = np.full((256, WIDTH), OTHER, dtype=np.float64)
+    table[46] = PERIOD + PERIOD_COLUMN * columns
+    table[[43, 45]] = SIGN
+    table[[69, 101]] = MARK + MARK_COLUMN * columns
+    return table
+
+
+def insideMasks():
+    """returns lookup table : first column of the field -> WIDTH // 8
+    uint64 masks of the field bytes in the row"""
+    import numpy as np
+    first = np.arange(WIDTH + 1)[:, None] - np.arange(0, WIDTH, 8)
+    return np.array([2 ** 64 - 2 ** (8 * k) for k in range(8)] + [0],
+                    dtype=np.uint64)[np.clip(first, 0, 8)]
+
+
+def _fixed(data, starts, ends, integer=False):
+    """vectorized parser of [+-]digits[.digits] fields : every field is
+    right aligned in WIDTH bytes row, digits of the row are converted
+    8 at once by integer arithmetic (SWAR)
+
+    Arguments:
+        data    -> uint8 numpy array of lines after WIDTH zero bytes
+        starts  -> numpy array of the first byte of every field
+        ends    -> numpy array of the byte after every field
+        integer -> True = fields with period aren't parsed
+
+    Returns:
+        tuple: (int64 digits without period, decimal places, negative,
+        parsed, (fields with exponent, exponent mark bytes)) numpy arrays,
+        fields with exponent have exactly one mark"""
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+    word = np.uint64                    # (python int operands are slow)
+    count = starts.size
+    length = ends - starts
+    first = WIDTH - length              # the first column of the field
+    text = sliding_window_view(data, WIDTH)[ends - WIDTH]
+    words = text.reshape(-1).view('<u8').reshape(count, -1)
+    # bytes before the field are masked, not digit bytes are rare : they
+    # are counted by bincount and removed
+    inside = np.take(insideMasks(), np.clip(first, 0, WIDTH), axis=0)
+    other = words ^ word(0x3030303030303030)
+    high = other & word(0x7f7f7f7f7f7f7f7f)
+    high += word(0x7676767676767676)    # bytes above '9' get the high bit
+    other |= high
+    other >>= word(7)
+    other &= inside
+    other &= word(0x0101010101010101)
+    positions = np.flatnonzero(other.view(np.bool_))
+    fields = positions // WIDTH
+    index = text.reshape(-1).take(positions).astype(np.intp)
+    index *= WIDTH
+    index += positions - fields * WIDTH     # (byte, column) of the table
+    sums = np.bincount(fields, byteWeights().reshape(-1).take(index), count)
+    sums = sums.astype(np.int64)
+    other *= word(255)
+    np.invert(other, out=other)
+    words &= inside
+    words &= other
+    counts = sums & (MARK_COLUMN - 1)
+    # fields with one exponent mark and no other bytes
+    marked = np.flatnonzero((counts >= MARK) & (counts < 2 * MARK) &
+                            (first >= 0))
+    marks = ends[marked] - WIDTH + (sums[marked] >> MARK_SHIFT & 31)
+    lead = data[starts]
+    negative = lead == 45
+    signed = negative | (lead == 43)
+    point = counts & (SIGN - 1)
+    parsed = (counts == point + signed * SIGN) & (point <= 1 - integer) & \
+        (length - signed - point > 0) & (first >= 0)
+    column = (sums >> PERIOD_SHIFT) * point     # of the period, 0 = none
+    decimals = (WIDTH - 1 - column) * point
+    # digits before the period are moved to its (zero) byte
+    before = np.take(insideMasks(), column, axis=0, out=high, mode='clip')
+    np.invert(before, out=before)
+    before &= words
+    words ^= before
+    carry = np.right_shift(before, word(56), out=other).reshape(-1)
+    before <<= word(8)
+    words |= before
+    words.reshape(-1)[1:] |= carry[:-1]     # (never from the last word)
+    # digits of the row as one integer
+    for (mask, multiplier, shift) in SWAR:
+        words &= word(mask)
+        words *= word(multiplier)
+        words >>= word(shift)
+    parsed &= words[:, 0] < word(10 ** (SIGNIFICANT - 16))  # int64 range
+    words = words.view(np.int64)
+    values = words[:, 0] * 10 ** 16 + words[:, 1] * 10 ** 8 + words[:, 2]
+    return (values, decimals, negative, parsed, (marked, marks))
+
+
+def parseNumbers(block, data, starts, ends):
+    """vectorized string to float64 conversion of number fields with the
+    same results as float() : the integer mantissa (see _fixed) is scaled
+    by power of ten (exact if both are exact floats) or corrected to the
+    nearest float (long time stamps), fields with exponent are parsed as
+    mantissa and exponent parts. Other fields (e.g. more than SIGNIFICANT
+    digits, 17 digits mantissa with exponent) are converted by float()
+
+    Arguments:
+        block  -> bytes of complete lines
+        data   -> uint8 numpy array of block
+        starts -> numpy array of the first byte of every field
+        ends   -> numpy array of the byte after every field
+
+    Returns:
+        float64 numpy array, ValueError is raised if any field is not
+        a number"""
+    import numpy as np
+    padded = np.concatenate((np.zeros(WIDTH, dtype=np.uint8), data))
+    (values, decimals, negative, exact, (rows, marks)) = _fixed(
+        padded, starts + WIDTH, ends + WIDTH)
+    power = -decimals
+    if(rows.size):                      # mantissa and exponent parts
+        (values[rows], decimals, negative[rows], exact[rows], _) = \
+            _fixed(padded, starts[rows] + WIDTH, marks)
+        (exponent, _, below, integer, _) = _fixed(padded, marks + 1,
+                                                  ends[rows] + WIDTH, True)
+        exact[rows] &= integer
+        power[rows] = np.where(below, -exponent, exponent) - decimals
+    # exact : both integer mantissa and power of ten are exact floats
+    parsed = exact.copy()
+    exact &= (values < 2 ** 53) & (np.abs(power) <= 22)
+    tens = 10.0 ** np.arange(23)
+    numbers = (values * tens[np.clip(power, 0, 22)] /
+               tens[np.clip(-power, 0, 22)])
+    rows = np.flatnonzero(parsed & ~exact & (power < 0) &
+                          (power >= -SIGNIFICANT))
+    if(rows.size):
+        (converted, nearest) = _nearest(values[rows], -power[rows])
+        numbers[rows[converted]] = nearest[converted]
+        exact[rows[converted]] = True
+    numbers = np.where(negative, -numbers, numbers)
+    for row in np.flatnonzero(~exact):
+        numbers[row] = float(block[starts[row]:ends[row]])
+    return numbers
+
+
+def parseFast(block, table):
+    """vectorized parser of complete text log lines
+
+    Arguments:
+        block -> bytes of complete lines (ends with newline)
+        table -> unitTable() array
+
+    Returns:
+        tuple of numpy arrays: (seconds, values, unit codes), ValueError
+        is raised if any line is broken"""
+    import numpy as np
+    data = np.frombuffer(block, dtype=np.uint8)
+    # exactly 3 tabs per line, the last one just before newline (no other
+    # control bytes)
+    separators = np.flatnonzero(data < 11)
+    if(not separators.size or separators.size % 4):
+        raise ValueError('broken lines')
+    separators = separators.reshape(-1, 4)
+    if(np.any(data[separators] != (9, 9, 9, 10)) or
+       np.any(separators[:, 2] + 1 != separators[:, 3])):
+        raise ValueError('broken lines')
+    first = separators[:, 1] + 1        # the first unit byte
+    length = separators[:, 2] - first
+    two = length == 2
+    if(not np.all(two | (length == 1))):
+        raise ValueError('unknown unit')
+    key = data[first].astype(np.uint16)
+    key[two] |= data[first[two] + 1].astype(np.uint16) << 8
+    units = table[key]
+    if(np.any(units == UNKNOWN)):
+        raise ValueError('unknown unit')
+    # time and value fields of every line
+    starts = np.concatenate(([0], separators[:-1, 3] + 1))
+    starts = np.column_stack((starts, separators[:, 0] + 1)).ravel()
+    ends = separators[:, :2].ravel()
+    if(np.any(ends <= starts)):
+        raise ValueError('broken number')
+    numbers = parseNumbers(block, data, starts, ends)
+    if(not np.isfinite(numbers).all()):
+        raise ValueError('not finite number')
+    numbers = numbers.reshape(-1, 2)
+    return (numbers[:, 0].copy(), numbers[:, 1].copy(), units)
+
+
+def parseSlow(block):
+    """line by line parser skipping broken lines and not finite numbers
+
+    Arguments:
+        block -> bytes of text log lines
+
+    Returns:
+        tuple of numpy arrays: (seconds, values, unit codes)"""
+    import numpy as np
+    codes = br.UNIT_CODES
+    (seconds, values, units) = ([], [], [])
+    for line in block.split(b'\n'):
+        fields = line.split(b'\t')
+        if(len(fields) != 4 or fields[3]):
+            continue
+        try:
+            sample = (float(fields[0]), float(fields[1]),
+                      codes[fields[2].decode()])
+        except (ValueError, KeyError, UnicodeDecodeError):
+            continue
+        if(not (math.isfinite(sample[0]) and math.isfinite(sample[1]))):
+            continue
+        seconds.append(sample[0])
+        values.append(sample[1])
+        units.append(sample[2])
+    return (np.array(seconds, dtype=np.float64),
+            np.array(values, dtype=np.float64),
+            np.array(units, dtype=np.uint8))
+
+
+def _blocks(fileName, offset, stop, chunkSize):
+    """yields chunks of complete lines of the file from offset to stop
+    offset (None = file end), the last line without newline (being
+    written) is not returned"""
+    with rtn.openSegment(fileName, 'rb') as fi:
+        if(offset):
+            fi.seek(offset)
+        rest = b''
+        while True:
+            size = chunkSize
+            if(stop is not None):
+                size = min(size, stop - offset)
+                offset += size
+            data = fi.read(size) if size > 0 else b''
+            if(not data):
+                return
+            block = rest + data
+            cut = block.rfind(b'\n') + 1
+            # no newline in the whole chunk (garbage) : dropped, so memory
+            # use stays bounded
+            rest = block[cut:] if cut else b''
+            if(cut):
+                yield block[:cut]
+
+
+def iterChunks(fileNames, start=None, end=None, unit=None,
+               chunkSize=CHUNK_SIZE):
+    """reads text logs chunk by chunk, memory use is bounded by chunkSize
+    (files bigger than memory can be processed)
+
+    Arguments:
+        fileNames -> text log file path or list of paths, read in the
+                     given order (e.g. sorted(glob.glob('save/*.txt')))
+        start     -> range start time, None = no limit
+        end       -> range end time (inclusive), None = no limit (time
+                     index of the log is used to read only the range, if
+                     it exists, otherwise reading of the file stops after
+                     the first newer chunk)
+        unit      -> unit string or list of unit strings (e.g. '=V'),
+                     None = every unit
+        chunkSize -> bytes read and parsed at once
+
+    Returns:
+        generator of (seconds, values, unit codes) numpy arrays tuples,
+        unit code is brymen257.UNITS index, lcd error readings have -1000
+        value (brymen257.ERROR_VALUE)"""
+    import numpy as np
+    if(isinstance(fileNames, str)):
+        fileNames = [fileNames]
+    if(isinstance(unit, str)):
+        unit = [unit]
+    codes = None if unit is None else np.array(
+        [br.UNIT_CODES[name] for name in unit], dtype=np.uint8)
+    table = unitTable()
+    compressed = tuple('.' + extension for extension in rtn.COMPRESSORS)
+    for fileName in fileNames:
+        (offset, stop) = (0, None)
+        if((start is not None or end is not None) and
+           not fileName.endswith(compressed)):
+            (offset, stop) = tix.byteRange(fileName, start, end, False)
+        for block in _blocks(fileName, offset, stop, chunkSize):
+            try:
+                (seconds, values, units) = parseFast(block, table)
+            except ValueError:
+                (seconds, values, units) = parseSlow(block)
+            if(not seconds.size):
+                continue
+            last = seconds[-1]
+            mask = None
+            if(start is not None):
+                mask = seconds >= start
+            if(end is not None):
+                mask = (seconds <= end) if mask is None else \
+                    mask & (seconds <= end)
+            if(codes is not None):
+                mask = np.isin(units, codes) if mask is None else \
+                    mask & np.isin(units, codes)
+            if(mask is not None):
+                (seconds, values, units) = (seconds[mask], values[mask],
+                                            units[mask])
+            if(seconds.size):
+                yield (seconds, values, units)
+            if(end is not None and last > end):
+                break                   # sample times are nondecreasing
+
+
+def load(fileNames, start=None, end=None, unit=None, chunkSize=CHUNK_SIZE):
+    """loads text logs into numpy arrays (see iterChunks for arguments)
+
+    Returns:
+        tuple of numpy arrays: (seconds, values, unit codes), unit names
+        are numpy.array(brymen257.UNITS)[unit codes]"""
+    import numpy as np
+    chunks = list(iterChunks(fileNames, start, end, unit, chunkSize))
+    if(not chunks):
+        return (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.uint8))
+    return tuple(np.concatenate(column) for column in zip(*chunks))
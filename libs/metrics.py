@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+pipeline metrics : counters and gauges read from the pipeline objects on
+demand (no cost in hot paths), histograms of latencies, snapshot API and
+Prometheus text exposition format file
+"""
+import bisect
+import os
+import threading
+import time
+
+# default histogram buckets (s) : 100 us .. 10 s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """cumulative histogram of observed values (Prometheus semantics)"""
+    def __init__(self, buckets=BUCKETS):
+        """Arguments:
+            buckets -> sorted upper bounds of buckets (+Inf is added)"""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        """adds new observation
+
+        Arguments:
+            value -> observed value (e.g. seconds)"""
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        """returns context manager observing duration of with block"""
+        return _Timer(self)
+
+    def snapshot(self):
+        """returns dict: count, sum, mean, buckets (upper bound ->
+        cumulative count)"""
+        with self.lock:
+            counts = list(self.counts)
+            (count, total) = (self.count, self.sum)
+        cumulative = []
+        running = 0
+        for (bound, number) in zip(self.buckets + (float('inf'),), counts):
+            running += number
+            cumulative.append((bound, running))
+        return {'count': count, 'sum': total,
+                'mean': total / count if count else None,
+                'buckets': cumulative}
+
+
+class _Timer(object):
+    """Histogram.time() context manager"""
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry(object):
+    """named metrics of one pipeline"""
+    def __init__(self, prefix='brylog_'):
+        """Arguments:
+            prefix -> metric names prefix"""
+        self.prefix = prefix
+        self.metrics = {}               # name -> (type, help, object)
+        self.lock = threading.Lock()
+
+    def _add(self, name, kind, description, metric):
+        with self.lock:
+            self.metrics[self.prefix + name] = (kind, description, metric)
+        return metric
+
+    def counter(self, name, description, function):
+        """registers monotonic counter
+
+        Arguments:
+            name        -> metric name (without prefix)
+            description -> help text
+            function    -> callable() -> current value"""
+        return self._add(name, 'counter', description, function)
+
+    def gauge(self, name, description, function):
+        """registers gauge (value which goes up and down, e.g. queue depth)
+
+        Arguments:
+            name        -> metric name (without prefix)
+            description -> help text
+            function    -> callable() -> current value"""
+        return self._add(name, 'gauge', description, function)
+
+    def histogram(self, name, description, buckets=BUCKETS):
+        """creates and registers histogram
+
+        Arguments:
+            name        -> metric name (without prefix)
+            description -> help text
+            buckets     -> upper bounds of buckets
+
+        Returns:
+            Histogram object"""
+        return self._add(name, 'histogram', description, Histogram(buckets))
+
+    def snapshot(self):
+        """returns dict: metric name -> value (None if not available) or
+        histogram snapshot dict"""
+        with self.lock:
+            metrics = dict(self.metrics)
+        values = {}
+        for (name, (kind, description, metric)) in metrics.items():
+            if(kind == 'histogram'):
+                values[name] = metric.snapshot()
+                continue
+            try:
+                values[name] = metric()
+            except (AttributeError, TypeError):  # object not created yet
+                values[name] = None
+        return values
+
+    def prometheus(self):
+        """returns metrics in Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted(snapshot):
+            (kind, description, metric) = self.metrics[name]
+            value = snapshot[name]
+            if(value is None):
+                continue
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            if(kind != 'histogram'):
+                lines.append('%s %s' % (name, float(value)))
+                continue
+            for (bound, count) in value['buckets']:
+                label = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket{le="%s"} %d' % (name, label, count))
+            lines.append('%s_sum %s' % (name, value['sum']))
+            lines.append('%s_count %d' % (name, value['count']))
+        return '\n'.join(lines) + '\n'
+
+    def writeTextFile(self, fileName):
+        """writes Prometheus text file atomically (node_exporter textfile
+        collector reads it any time)
+
+        Arguments:
+            fileName -> output file path"""
+        temporary = fileName + '.tmp'
+        with open(temporary, 'w') as fo:
+            fo.write(self.prometheus())
+        os.replace(temporary, fileName)
@@ -4,9 +4,12 @@ serial device plotting class
 """
 import matplotlib as mpl
 mpl.use('TkAgg')
-from collections import deque
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import tkinter as tk
+import queue
+import time
+import libs.brymen257 as br
+import libs.history as hst
 
 
 QUANTITY = {'=V': ('DC Voltage plot', '[V]'),
@@ -18,34 +21,121 @@ QUANTITY = {'=V': ('DC Voltage plot', '[V]'),
             ' C': ('Temperature plot', r'$[^\circ C]$')}
 
 class PlotFrame(tk.Frame):
-    def __init__(self, root, queueObj, delay, **rest):
+    def __init__(self, root, queueObj, delay, blit=True, margin=0.25,
+                 fps=None, policy='all', historySize=2 ** 18,
+                 renderTime=None, **rest):
         """Arguments:
             root        -> parent object
             queueObj    -> queue.Queue object which services serial dev
+            delay       -> time (ms) between plot frames
+            blit        -> redraw only the waveform line over cached
+                           background (full redraw on unit or range change)
+            margin      -> extra y range (fraction of data range) added in
+                           blit mode, so small changes don't move the axes
+            fps         -> target frame rate, overrides delay if not None
+            policy      -> 'all' : plot every sample waiting in the queue,
+                           'latest' : plot only the newest one, drop backlog
+            historySize -> number of plotted samples (min/max decimated to
+                           plot width, so drawing cost doesn't depend on it,
+                           axes limits come from the decimated data too)
+            renderTime  -> metrics.Histogram object for frame render time,
+                           None = not measured
             **rest      -> kwargs{} for tkinter.Frame"""
         tk.Frame.__init__(self, master=root, **rest)
         self.grid()
         self.root = root
         neutral = self.root.cget('background')       # neutral color of widgets
         # data tuple index to plot(unique for each device)
-        self.plotBuffer = deque([0] * 100)           # 100 points plot buffer
+        self.plotBuffer = hst.History(historySize)   # numpy ring buffer
+        self.renderTime = renderTime
         self.queueObj = queueObj
-        self.delay = delay
+        self.delay = delay if fps is None else max(int(1000 / fps), 1)
+        self.policy = policy
+        self.blit = blit
+        self.margin = margin
+        self.unit = None                             # unit on the axes now
+        self.background = None                       # cached blit background
         self.myFigure = mpl.figure.Figure(facecolor=neutral, edgecolor=neutral)
         self.myFigure.subplots_adjust(left=0.15, right=0.85)
         self.myAxes = self.myFigure.add_subplot(1, 1, 1)
         self.myAxes.grid(True)
         self.myAxes.set_title("Realtime Waveform Plot")
-        self.myLine, = self.myAxes.plot(range(100), self.plotBuffer, '-',
-                                        linewidth=2)
+        self.myAxes.set_xlabel('time [s]')
+        self.myLine, = self.myAxes.plot([], [], '-', linewidth=2,
+                                        animated=blit)
+        self.myAxes.set_xlim(-1, 0)
         self.canvas = FigureCanvasTkAgg(self.myFigure, master=self.root)
         self.canvas.get_tk_widget().grid()
+        if(self.blit):  # full redraws (also window resizing) renew background
+            self.canvas.mpl_connect('draw_event', self._onDraw)
+
+    def _onDraw(self, event):
+        """draw_event handler, caches static background for blitting"""
+        self.background = self.canvas.copy_from_bbox(self.myAxes.bbox)
+        self.myAxes.draw_artist(self.myLine)
+        self.canvas.blit(self.myAxes.bbox)
+
+    def _limitsMoved(self, lim, view):
+        """checks if data range needs new axes limits
+
+        Arguments:
+            lim  -> [min, max] data range
+            view -> (low, high) axes limits
+
+        Returns:
+            boolean"""
+        (low, high) = view
+        if(lim[0] < low or lim[1] > high):
+            return True                              # out of the view
+        span = lim[1] - lim[0]
+        return span > 0 and (high - low) > 4 * (1 + 2 * self.margin) * span
+
+    def _plotData(self):
+        """returns decimated plot data, x -> seconds before the newest one
+
+        Returns:
+            (x, y) numpy arrays"""
+        (x, y) = self.plotBuffer.decimate(self.myAxes.bbox.width)
+        return (x - self.plotBuffer.latest(1)[0][0], y)
+
+    def _dataLimits(self, y):
+        """returns [min, max] of plotted data (decimated data keeps min and
+        max of every pixel, so it's exact and costs O(width))
+
+        Arguments:
+            y -> plotted data (numpy array)"""
+        return [y.min(), y.max()]
+
+    def _blitPlot(self, unit):
+        """incremental rendering, redraws only the waveform line
+
+        Arguments:
+            unit -> string, unit of the newest sample"""
+        (x, y) = self._plotData()
+        self.myLine.set_data(x, y)
+        lim = self._dataLimits(y)
+        if(unit != self.unit or self.background is None or
+           self._limitsMoved(lim, self.myAxes.get_ylim()) or
+           self._limitsMoved([x[0], 0], self.myAxes.get_xlim())):
+            if(unit != self.unit):
+                self.unit = unit
+                self.myAxes.set_title(self._setTitle(unit))
+                self.myAxes.set_ylabel(self._setLabel(unit))
+            span = ((lim[1] - lim[0]) * self.margin or
+                    abs(lim[1]) * self.margin or 1)
+            self.myAxes.set_ylim(lim[0] - span, lim[1] + span)
+            self.myAxes.set_xlim(min(x[0] * (1 + self.margin), -1), 0)
+            self.canvas.draw()                       # -> self._onDraw
+            return
+        self.canvas.restore_region(self.background)
+        self.myAxes.draw_artist(self.myLine)
+        self.canvas.blit(self.myAxes.bbox)
 
     def _setLimits(self, dequeObj):
         """sets y range limits for self.plotObj
 
         Aruments:
-            dequeObj -> collections.deque object filled with data to plot
+            dequeObj -> sequence (numpy array) filled with data to plot
 
         Returns:
             [min, max] list"""
@@ -73,22 +163,63 @@ class PlotFrame(tk.Frame):
             string, updated waveform plot`s y axis label"""
         return QUANTITY[label][1]
 
+    def _drain(self):
+        """takes every sample waiting in the queue without blocking
+
+        Returns:
+            list of samples (only as many as were waiting at the call)"""
+        samples = []
+        try:
+            for i in range(self.queueObj.qsize()):
+                samples.append(self.queueObj.get_nowait())
+        except queue.Empty:
+            pass
+        return samples
+
     def plot(self):
-        """ploting function using matplotlib and tkinter objects"""
-        buf = self.queueObj.get()
-        self.myAxes.set_title(self._setTitle(buf[2]))   # change title
-        self.myAxes.set_ylabel(self._setLabel(buf[2]))  # change label
-        self.plotBuffer.popleft()                     # remove leftmost element
-        self.plotBuffer.append(buf[1])                # add to right new el
-        self.myLine.set_data(range(100), self.plotBuffer)
-        lim = self._setLimits(self.plotBuffer)
-        self.myAxes.axis([1, 100, lim[0], lim[1]])
+        """ploting function using matplotlib and tkinter objects,
+        drains the queue and renders once per frame"""
+        try:
+            self._render(self._drain())
+        finally:                                      # loop never stops
+            self.master.after(self.delay, self.plot)  # recursive!!!
+
+    def _render(self, samples):
+        """plots drained samples (see plot)
+
+        Arguments:
+            samples -> list of (time, value, unit) samples or raw records"""
+        if(samples):
+            start = time.perf_counter()
+            if(self.policy == 'latest'):
+                samples = samples[-1:]               # drop backlog
+            else:
+                samples = samples[-self.plotBuffer.size:]
+            for buf in samples:
+                if(len(buf) == 2):                    # raw capture record
+                    buf = br.decode_frame(buf[1])
+                self.plotBuffer.append(buf[0], buf[1])  # oldest el removed
+            if(self.blit):
+                self._blitPlot(buf[2])
+            else:
+                self._drawPlot(buf[2])
+            if(self.renderTime is not None):
+                self.renderTime.observe(time.perf_counter() - start)
+
+    def _drawPlot(self, unit):
+        """full rendering of the whole figure
+
+        Arguments:
+            unit -> string, unit of the newest sample"""
+        self.myAxes.set_title(self._setTitle(unit))     # change title
+        self.myAxes.set_ylabel(self._setLabel(unit))    # change label
+        (x, y) = self._plotData()
+        self.myLine.set_data(x, y)
+        lim = self._setLimits(self._dataLimits(y))
+        self.myAxes.axis([min(x[0], -1), 0, lim[0], lim[1]])
         self.canvas.draw()
-        self.master.after(self.delay, self.plot)      # recursive!!!
 
 if __name__ == '__main__':
-    import brymen257 as br
-    import queue
     import threading
     multimetr = br.Brymen257('/dev/ttyUSB0')
     root = tk.Tk()
@@ -103,5 +234,5 @@ if __name__ == '__main__':
     p = PlotFrame(root, queueObj=myQueue, delay=25)
     p.grid()
     thr.start()
-    p.plot(25)
+    p.plot()
     root.mainloop()
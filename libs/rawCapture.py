@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+raw frames capture format (decoding is deferred to offline processing)
+
+file layout:
+    header  -> MAGIC (8 bytes) + version (uint16) + record size (uint16) +
+               wall clock (int64 ns, time.time_ns()) and monotonic clock
+               (int64 ns, time.monotonic_ns()) at the file creation
+    records -> fixed width little endian records:
+               uint64 monotonic ns timestamp, 15 bytes raw frame
+"""
+import struct
+import time
+import os
+import libs.brymen257 as br
+import libs.sampleWriter as smw
+
+MAGIC = b'BRYRAW\x00\x01'
+VERSION = 1
+HEADER = struct.Struct('<8sHHqq')
+RECORD = struct.Struct('<Q%ds' % br.FRAME_SIZE)
+
+
+def recordType():
+    """returns numpy dtype of the raw capture record"""
+    import numpy as np
+    return np.dtype([('ns', '<u8'), ('frame', 'u1', (br.FRAME_SIZE,))])
+
+
+def readHeader(fo):
+    """checks raw capture header
+
+    Arguments:
+        fo -> binary file object at position 0
+
+    Returns:
+        (header size, wall clock ns, monotonic clock ns)"""
+    header = fo.read(HEADER.size)
+    if(len(header) != HEADER.size):
+        raise ValueError('not a raw capture file (no header)')
+    (magic, version, size, wall, mono) = HEADER.unpack(header)
+    if(magic != MAGIC or version != VERSION or size != RECORD.size):
+        raise ValueError('not supported raw capture file')
+    return (HEADER.size, wall, mono)
+
+
+class RawWriter(smw.BatchWriter):
+    """appends (monotonic ns, raw frame) records to the capture file,
+    wall and mono attributes are the header clocks (ns)"""
+    mode = 'ab'
+    raw = True
+
+    def __init__(self, fileName, **rest):
+        """Arguments:
+            fileName -> output file path (new file, timestamps of records
+                        appended by other process would be wrong)
+            **rest   -> BatchWriter flush arguments"""
+        smw.BatchWriter.__init__(self, fileName, **rest)
+        if(self.fo.tell() == 0):
+            (self.wall, self.mono) = (time.time_ns(), time.monotonic_ns())
+            self.fo.write(HEADER.pack(MAGIC, VERSION, RECORD.size,
+                                      self.wall, self.mono))
+        else:
+            with open(fileName, 'rb') as fo:
+                (offset, self.wall, self.mono) = readHeader(fo)
+
+    def _format(self, records):
+        """formats batch of raw records
+
+        Arguments:
+            records -> list of (monotonic ns, raw frame) tuples
+
+        Returns:
+            bytes with one record per frame"""
+        pack = RECORD.pack
+        return b''.join([pack(ns, frame) for (ns, frame) in records])
+
+
+def readFrames(fileName):
+    """reads raw capture file
+
+    Arguments:
+        fileName -> raw capture file path
+
+    Returns:
+        generator of (time.time() like seconds, raw frame) tuples"""
+    with open(fileName, 'rb') as fo:
+        (offset, wall, mono) = readHeader(fo)
+        data = fo.read(RECORD.size * 4096)
+        while len(data) >= RECORD.size:
+            whole = len(data) - len(data) % RECORD.size
+            for (ns, frame) in RECORD.iter_unpack(data[:whole]):
+                yield ((wall + ns - mono) / 1e9, frame)
+            data = data[whole:] + fo.read(RECORD.size * 4096)
+
+
+def decode(fileName):
+    """decodes raw capture file with brymen257.decode_frame
+
+    Arguments:
+        fileName -> raw capture file path
+
+    Returns:
+        generator of brymen257.Sample(seconds, value, unit), lcd error
+        readings have -1000 value (the same as decodeAll)"""
+    decodeFrame = br.decode_frame
+    for (seconds, frame) in readFrames(fileName):
+        yield decodeFrame(frame, seconds)
+
+
+def decodeAll(fileName):
+    """decodes whole raw capture file with brymen257.decode_frames
+
+    Arguments:
+        fileName -> raw capture file path
+
+    Returns:
+        tuple of numpy arrays: (seconds, values, unit codes)"""
+    import numpy as np
+    with open(fileName, 'rb') as fo:
+        (offset, wall, mono) = readHeader(fo)
+    count = (os.path.getsize(fileName) - offset) // RECORD.size
+    records = np.memmap(fileName, dtype=recordType(), mode='r',
+                        offset=offset, shape=(count,)) if count else \
+        np.zeros(0, dtype=recordType())
+    seconds = (wall + (records['ns'].astype(np.int64) - mono)) / 1e9
+    return br.decode_frames(records['frame'], seconds)
+
+
+if __name__ == '__main__':
+    import sys
+    if(len(sys.argv) != 3):
+        sys.exit('usage: python -m libs.rawCapture CAPTURE TEXTLOG\n'
+                 '(decodes raw capture into time\\tvalue\\tunit\\t log)')
+    writer = smw.BatchWriter(sys.argv[2])
+    batch = []
+    for sample in decode(sys.argv[1]):
+        batch.append(sample)
+        if(len(batch) >= writer.batchSize):
+            writer.write(batch)
+            batch = []
+    writer.write(batch)
+    writer.close()
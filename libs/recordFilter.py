@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+recording filters between the sample bus and the writers : deadband
+(change only) and run-length collapsing with heartbeat records
+
+run-length text format (.runs):
+    start time\tvalue\tunit\tend time\tcount\t\n
+    (the first three columns have the text log layout)
+"""
+import libs.brymen257 as br
+import libs.sampleWriter as smw
+
+
+class Deadband(object):
+    """passes sample only if it leaves deadband of the last recorded one,
+    changes unit or error state, or heartbeat interval passed. The last
+    suppressed sample before a change is recorded too, so every step keeps
+    its exact start and end"""
+    def __init__(self, absolute=0.0, relative=0.0, heartbeat=None,
+                 edges=True):
+        """Arguments:
+            absolute  -> absolute deadband (0 = every change is recorded)
+            relative  -> deadband relative to the recorded value
+            heartbeat -> max time (s) between records, None = no limit
+            edges     -> record the last suppressed sample before change"""
+        self.absolute = absolute
+        self.relative = relative
+        self.heartbeat = heartbeat
+        self.edges = edges
+        self.last = None                # the last recorded sample
+        self.held = None                # the last suppressed sample
+        self.received = 0
+        self.recorded = 0
+
+    def _changed(self, sample):
+        """checks if sample has to be recorded"""
+        (t, v, u) = sample
+        (lastT, lastV, lastU) = self.last
+        if(u != lastU or (v == br.ERROR_VALUE) != (lastV == br.ERROR_VALUE)):
+            return True
+        if(self.heartbeat is not None and t - lastT >= self.heartbeat):
+            return True
+        return abs(v - lastV) > max(self.absolute,
+                                    self.relative * abs(lastV))
+
+    def __call__(self, samples):
+        """filters batch of samples
+
+        Arguments:
+            samples -> list of (time, value, unit) tuples
+
+        Returns:
+            list of samples to record"""
+        output = []
+        for sample in samples:
+            if(self.last is None or self._changed(sample)):
+                if(self.edges and self.held is not None):
+                    output.append(self.held)
+                output.append(sample)
+                self.last = sample
+                self.held = None
+            else:
+                self.held = sample
+        self.received += len(samples)
+        self.recorded += len(output)
+        return output
+
+    def finish(self):
+        """returns pending records (the last suppressed sample)"""
+        output = [] if self.held is None else [self.held]
+        self.held = None
+        self.recorded += len(output)
+        return output
+
+
+class RunLength(object):
+    """collapses runs of samples within deadband of the run's first value
+    into (start, value, unit, end, count) records, a run is closed at
+    least every heartbeat seconds"""
+    def __init__(self, absolute=0.0, relative=0.0, heartbeat=None):
+        """Arguments:
+            absolute  -> absolute deadband (0 = identical values only)
+            relative  -> deadband relative to the run value
+            heartbeat -> max run time span (s), None = no limit"""
+        self.absolute = absolute
+        self.relative = relative
+        self.heartbeat = heartbeat
+        self.run = None                 # [start, value, unit, end, count]
+        self.received = 0
+        self.recorded = 0
+
+    def _continues(self, t, v, u):
+        """checks if sample belongs to the current run"""
+        (start, value, unit, end, count) = self.run
+        if(u != unit or (v == br.ERROR_VALUE) != (value == br.ERROR_VALUE)):
+            return False
+        if(self.heartbeat is not None and t - start >= self.heartbeat):
+            return False
+        return abs(v - value) <= max(self.absolute,
+                                     self.relative * abs(value))
+
+    def __call__(self, samples):
+        """filters batch of samples
+
+        Arguments:
+            samples -> list of (time, value, unit) tuples
+
+        Returns:
+            list of closed (start, value, unit, end, count) runs"""
+        output = []
+        for (t, v, u) in samples:
+            if(self.run is not None and self._continues(t, v, u)):
+                self.run[3] = t
+                self.run[4] += 1
+                continue
+            if(self.run is not None):
+                output.append(tuple(self.run))
+            self.run = [t, v, u, t, 1]
+        self.received += len(samples)
+        self.recorded += len(output)
+        return output
+
+    def finish(self):
+        """returns pending records (the current run)"""
+        output = [] if self.run is None else [tuple(self.run)]
+        self.run = None
+        self.recorded += len(output)
+        return output
+
+
+class RunWriter(smw.BatchWriter):
+    """writes run-length records (see RunLength) as text"""
+    def _format(self, runs):
+        """formats batch of runs
+
+        Arguments:
+            runs -> list of (start, value, unit, end, count) tuples
+
+        Returns:
+            string with one line per run"""
+        return ''.join(['%s\t%s\t%s\t%s\t%s\t\n' % run for run in runs])
+
+
+class FilteredWriter(object):
+    """BatchWriter compatible wrapper passing every batch through the
+    filter before writing (runs in the saving thread, so the producer and
+    the plot still get every sample)"""
+    def __init__(self, writer, recordFilter):
+        """Arguments:
+            writer       -> BatchWriter (or RotatingWriter) object
+            recordFilter -> Deadband or RunLength object"""
+        if(writer.raw):
+            raise ValueError('raw frames can not be filtered')
+        self.writer = writer
+        self.filter = recordFilter
+        self.raw = False
+        self.flushInterval = writer.flushInterval
+        self.batchSize = writer.batchSize
+
+    def write(self, samples):
+        records = self.filter(samples)
+        if(records):
+            self.writer.write(records)
+        else:                           # suppressed, time based work only
+            self.writer.flushIfDue()
+
+    def flushIfDue(self):
+        self.writer.flushIfDue()
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        """writes pending records and closes the writer"""
+        records = self.filter.finish()
+        if(records):
+            self.writer.write(records)
+        self.writer.close()
+
+    drain = smw.BatchWriter.drain
+
+    def __getattr__(self, name):
+        if(name == 'writer'):
+            raise AttributeError(name)
+        return getattr(self.writer, name)   # written, flushes, bytes, ...
+
+
+def createFilter(extension, deadband=None, relative=None, heartbeat=None):
+    """returns recording filter for the save format
+
+    Arguments:
+        extension -> save file extension, '.runs' gets RunLength
+        deadband  -> absolute deadband, None = no filter for samples
+        relative  -> relative deadband, None = no filter for samples
+        heartbeat -> max time (s) between records
+
+    Returns:
+        Deadband, RunLength or None"""
+    if(extension == '.runs'):
+        return RunLength(deadband or 0.0, relative or 0.0, heartbeat)
+    if(deadband is None and relative is None):
+        return None
+    return Deadband(deadband or 0.0, relative or 0.0, heartbeat)
+
+
+def readRuns(fileName):
+    """reads run-length text file
+
+    Arguments:
+        fileName -> .runs file path
+
+    Returns:
+        generator of (start, value, unit, end, count) tuples"""
+    with open(fileName, 'r') as fi:
+        for line in fi:
+            fields = line.split('\t')
+            value = float(fields[1])
+            if(value == br.ERROR_VALUE):
+                value = br.ERROR_VALUE
+            yield (float(fields[0]), value, fields[2], float(fields[3]),
+                   int(fields[4]))
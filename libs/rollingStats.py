@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+O(1) per sample rolling statistics of the multimeter readings
+"""
+import collections
+import threading
+import math
+import libs.brymen257 as br
+
+Stats = collections.namedtuple('Stats', ('count', 'min', 'max', 'mean',
+                                         'std', 'errors', 'unit'))
+Stats.__doc__ = """rolling statistics snapshot (min, max, mean, std are None
+for empty window)"""
+
+
+class RollingStats(object):
+    """rolling min/max (monotonic deques) and mean/variance (Welford's
+    algorithm with removal) over the last window samples or duration
+    seconds. Error readings are only counted, unit change clears the
+    window. Updating and snapshots are thread safe"""
+    def __init__(self, window=1000, duration=None):
+        """Arguments:
+            window   -> max number of samples in the window
+            duration -> max time span (s) of the window, None = no limit"""
+        self.window = window
+        self.duration = duration
+        self.lock = threading.Lock()
+        self._clear()
+
+    def clear(self):
+        """empties the window"""
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        """empties the window (lock must be held)"""
+        self.samples = collections.deque()       # values
+        self.times = collections.deque()         # times (duration only)
+        self.minDeque = collections.deque()      # (index, value) increasing
+        self.maxDeque = collections.deque()      # (index, value) decreasing
+        self.index = 0                           # number of added samples
+        self.mean = 0.0
+        self.m2 = 0.0                            # sum of squared differences
+        self.errors = 0
+        self.unit = None
+
+    def update(self, seconds, value, unit):
+        """adds new sample to the window
+
+        Arguments:
+            seconds -> sample time
+            value   -> sample value
+            unit    -> sample unit"""
+        with self.lock:
+            if(unit != self.unit):
+                self._clear()
+                self.unit = unit
+            if(value == br.ERROR_VALUE):
+                self.errors += 1
+                self._evict(seconds)
+                return
+            self.samples.append(value)
+            if(self.duration is not None):
+                self.times.append(seconds)
+            n = len(self.samples)
+            delta = value - self.mean
+            self.mean += delta / n
+            self.m2 += delta * (value - self.mean)
+            while self.minDeque and self.minDeque[-1][1] >= value:
+                self.minDeque.pop()
+            self.minDeque.append((self.index, value))
+            while self.maxDeque and self.maxDeque[-1][1] <= value:
+                self.maxDeque.pop()
+            self.maxDeque.append((self.index, value))
+            self.index += 1
+            self._evict(seconds)
+
+    def _evict(self, seconds):
+        """removes samples out of the window
+
+        Arguments:
+            seconds -> time of the newest sample"""
+        samples = self.samples
+        times = self.times
+        while(len(samples) > self.window or
+              (times and seconds - times[0] > self.duration)):
+            value = samples.popleft()
+            if(times):
+                times.popleft()
+            n = len(samples)
+            if(n == 0):
+                self.mean = 0.0
+                self.m2 = 0.0
+                break
+            delta = value - self.mean
+            self.mean -= delta / n
+            self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+        oldest = self.index - len(samples)
+        while self.minDeque and self.minDeque[0][0] < oldest:
+            self.minDeque.popleft()
+        while self.maxDeque and self.maxDeque[0][0] < oldest:
+            self.maxDeque.popleft()
+
+    def limits(self):
+        """returns (min, max) of the window or None if it is empty"""
+        with self.lock:
+            if(not self.samples):
+                return None
+            return (self.minDeque[0][1], self.maxDeque[0][1])
+
+    def snapshot(self):
+        """returns Stats namedtuple"""
+        with self.lock:
+            n = len(self.samples)
+            if(n == 0):
+                return Stats(0, None, None, None, None, self.errors,
+                             self.unit)
+            return Stats(n, self.minDeque[0][1], self.maxDeque[0][1],
+                         self.mean, math.sqrt(self.m2 / n), self.errors,
+                         self.unit)
+
+    def __str__(self):
+        stats = self.snapshot()
+        if(stats.count == 0):
+            return 'n=0 errors=%d' % stats.errors
+        return ('n=%d min=%g max=%g mean=%g std=%g errors=%d unit=%r' %
+                stats)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+size and time based rotation of saved files with background compression
+of closed segments and manifest of segments' time ranges
+
+segment files:  <base>.<NNNN><extension>[.gz|.xz]
+manifest:       <base>.manifest (one JSON line per closed segment: file,
+                first and last sample wall clock time (s, raw capture
+                record stamps are converted), samples, bytes, compressed
+                bytes, compression error if any)
+"""
+import gzip
+import json
+import lzma
+import os
+import queue
+import shutil
+import threading
+import time
+import libs.sampleWriter as smw
+
+COMPRESSORS = {'gz': gzip.open, 'xz': lzma.open}
+
+
+class Compressor(object):
+    """background worker : compresses closed segments (streaming, 1 MiB
+    chunks) and appends their manifest entries in the closing order"""
+    def __init__(self, manifest, compression=None):
+        """Arguments:
+            manifest    -> manifest file path
+            compression -> 'gz', 'xz' or None (entries only)"""
+        if(compression is not None and compression not in COMPRESSORS):
+            raise ValueError('unknown compression: ' + str(compression))
+        self.manifest = manifest
+        self.compression = compression
+        self.queue = queue.Queue()
+        self.errors = 0
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def submit(self, entry):
+        """queues closed segment (never waits)
+
+        Arguments:
+            entry -> manifest dict with 'file' segment path"""
+        self.queue.put(entry)
+
+    def _compress(self, fileName):
+        """returns compressed file path (source is removed)"""
+        target = fileName + '.' + self.compression
+        temporary = target + '.tmp'
+        try:
+            with open(fileName, 'rb') as fi:
+                with COMPRESSORS[self.compression](temporary, 'wb') as fo:
+                    shutil.copyfileobj(fi, fo, 2 ** 20)
+        except BaseException:
+            if(os.path.exists(temporary)):
+                os.remove(temporary)
+            raise
+        os.replace(temporary, target)
+        os.remove(fileName)
+        return target
+
+    def _work(self):
+        """worker thread loop"""
+        while True:
+            entry = self.queue.get()
+            if(entry is smw.STOP):
+                return
+            if(self.compression is not None):
+                try:
+                    entry['file'] = self._compress(entry['file'])
+                    entry['compressed'] = os.path.getsize(entry['file'])
+                except Exception as error:
+                    # uncompressed segment is kept, the worker goes on
+                    self.errors += 1
+                    entry['error'] = '%s: %s' % (type(error).__name__, error)
+            entry['file'] = os.path.basename(entry['file'])
+            try:
+                with open(self.manifest, 'a') as fo:
+                    fo.write(json.dumps(entry) + '\n')
+            except OSError:
+                self.errors += 1
+
+    def close(self):
+        """waits for queued segments"""
+        self.queue.put(smw.STOP)
+        self.thread.join()
+
+
+class RotatingWriter(object):
+    """BatchWriter compatible writer splitting output into segments by size
+    and/or wall clock interval. Closed segments are handed over to
+    Compressor, so the writing thread never waits for compression"""
+    def __init__(self, fileName, writerClass=smw.BatchWriter, maxBytes=None,
+                 interval=None, compression=None, **rest):
+        """Arguments:
+            fileName    -> output file path, segments get numbers before the
+                           extension
+            writerClass -> segment writer class (see sampleWriter.writerClass)
+            maxBytes    -> max segment size, None = no limit
+            interval    -> segment wall clock time span (s), segments start
+                           on multiples of interval (3600 -> full hours),
+                           None = no limit
+            compression -> 'gz', 'xz' or None
+            **rest      -> writerClass flush arguments"""
+        (self.base, self.extension) = os.path.splitext(fileName)
+        self.fileName = fileName
+        self.writerClass = writerClass
+        self.raw = writerClass.raw
+        self.maxBytes = maxBytes
+        self.interval = interval
+        self.rest = rest
+        self.compressor = Compressor(self.base + '.manifest', compression)
+        self.segment = 0
+        self.skipped = 0                # see sampleWriter.BatchWriter.drain
+        self.writer = None
+        self._open()
+        self.flushInterval = self.writer.flushInterval
+        self.batchSize = self.writer.batchSize
+
+    def _open(self):
+        """starts new segment"""
+        self.segment += 1
+        self.segmentName = '%s.%04d%s' % (self.base, self.segment,
+                                          self.extension)
+        self.writer = self.writerClass(self.segmentName, **self.rest)
+        self.first = None               # first and last sample time
+        self.last = None
+        self.count = 0
+        self.deadline = None
+        if(self.interval):
+            self.deadline = (time.time() // self.interval + 1) * self.interval
+
+    def _close(self):
+        """closes current segment and queues it for compression"""
+        self.writer.close()
+        (first, last) = (self.first, self.last)
+        if(self.raw and first is not None):
+            # monotonic ns record stamps -> wall clock seconds (the same
+            # conversion as rawCapture.readFrames)
+            offset = self.writer.wall - self.writer.mono
+            (first, last) = ((first + offset) / 1e9, (last + offset) / 1e9)
+        self.compressor.submit({'file': self.segmentName,
+                                'first': first, 'last': last,
+                                'samples': self.count,
+                                'bytes': self.writer.bytes,
+                                'compressed': None})
+
+    def rotate(self):
+        """closes current segment and starts new one"""
+        self._close()
+        self._open()
+
+    def _due(self):
+        """checks rotation conditions"""
+        if(self.count == 0):
+            return False                # no empty segments
+        if(self.maxBytes is not None and self.writer.bytes >= self.maxBytes):
+            return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def write(self, samples):
+        """writes batch of samples (see BatchWriter.write)
+
+        Arguments:
+            samples -> list of (time, value, unit) tuples or raw records"""
+        if(not samples):
+            return
+        if(self._due()):
+            self.rotate()
+        self.writer.write(samples)
+        if(self.first is None):
+            self.first = samples[0][0]
+        self.last = samples[-1][0]
+        self.count += len(samples)
+
+    def flushIfDue(self):
+        """see BatchWriter.flushIfDue, also rotates idle segments"""
+        if(self.deadline is not None and self._due()):
+            self.rotate()
+        self.writer.flushIfDue()
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        """closes last segment and waits for background compression"""
+        self._close()
+        self.compressor.close()
+
+    drain = smw.BatchWriter.drain
+
+    @property
+    def written(self):
+        return self.writer.written
+
+    @property
+    def flushes(self):
+        return self.writer.flushes
+
+    @property
+    def bytes(self):
+        return self.writer.bytes
+
+
+def readManifest(fileName):
+    """reads manifest of rotated segments
+
+    Arguments:
+        fileName -> manifest file path
+
+    Returns:
+        list of dicts (file path is relative to the manifest directory)"""
+    with open(fileName, 'r') as fi:
+        return [json.loads(line) for line in fi if line.strip()]
+
+
+def openSegment(fileName, mode='rt'):
+    """opens segment file, compressed or not
+
+    Arguments:
+        fileName -> segment file path
+        mode     -> open mode ('rt' text, 'rb' binary)
+
+    Returns:
+        file object"""
+    for (extension, opener) in COMPRESSORS.items():
+        if(fileName.endswith('.' + extension)):
+            return opener(fileName, mode)
+    return open(fileName, mode)
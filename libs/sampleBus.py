@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+publish/subscribe bus for samples : one producer, many consumers,
+every consumer has its own bounded buffer and backpressure policy
+"""
+import collections
+import threading
+import queue
+import time
+
+BLOCK = 'block'         # producer waits for free space
+DROP_OLDEST = 'oldest'  # the oldest buffered samples are dropped
+DROP_NEWEST = 'newest'  # new samples are dropped
+
+
+class Subscription(object):
+    """bounded ring buffer of one consumer, queue.Queue compatible for
+    consumers (get, get_nowait, qsize, empty, put)"""
+    def __init__(self, name, size, policy):
+        """Arguments:
+            name   -> consumer name (for statistics)
+            size   -> max number of buffered samples
+            policy -> BLOCK, DROP_OLDEST or DROP_NEWEST"""
+        if(policy not in (BLOCK, DROP_OLDEST, DROP_NEWEST)):
+            raise ValueError('unknown backpressure policy: ' + str(policy))
+        self.name = name
+        self.size = size
+        self.policy = policy
+        self.buffer = collections.deque()
+        self.dropped = 0                # number of dropped samples
+        self.closed = False             # unsubscribed, BLOCK doesn't wait
+        self.condition = threading.Condition()
+
+    def publish(self, samples):
+        """adds batch of samples according to backpressure policy
+        (called by SampleBus)
+
+        Arguments:
+            samples -> list of samples"""
+        with self.condition:
+            buffer = self.buffer
+            if(self.policy == DROP_OLDEST):
+                buffer.extend(samples)
+                overflow = len(buffer) - self.size
+                if(overflow > 0):
+                    self.dropped += overflow
+                    for i in range(overflow):
+                        buffer.popleft()
+            elif(self.policy == DROP_NEWEST):
+                room = max(self.size - len(buffer), 0)
+                buffer.extend(samples[:room])
+                self.dropped += max(len(samples) - room, 0)
+            else:
+                for sample in samples:
+                    while len(buffer) >= self.size and not self.closed:
+                        self.condition.wait()
+                    buffer.append(sample)
+                    self.condition.notify_all()
+            self.condition.notify_all()
+
+    def put(self, item):
+        """adds control item (e.g. sampleWriter.STOP) regardless of policy
+        and size limit
+
+        Arguments:
+            item -> any object"""
+        with self.condition:
+            self.buffer.append(item)
+            self.condition.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """returns the oldest buffered item (queue.Queue.get)
+
+        Arguments:
+            block   -> wait for item if buffer is empty
+            timeout -> max waiting time (s), None = no limit
+
+        Returns:
+            item, raises queue.Empty if there is no item"""
+        with self.condition:
+            if(block and not self.buffer):
+                deadline = None if timeout is None else \
+                    time.monotonic() + timeout
+                while not self.buffer:
+                    wait = None
+                    if(deadline is not None):
+                        wait = deadline - time.monotonic()
+                        if(wait <= 0):
+                            break
+                    self.condition.wait(wait)
+            if(not self.buffer):
+                raise queue.Empty
+            item = self.buffer.popleft()
+            self.condition.notify_all()     # BLOCK policy producer
+            return item
+
+    def get_nowait(self):
+        """returns the oldest buffered item without waiting"""
+        return self.get(False)
+
+    def drain(self):
+        """returns list of every buffered item without waiting"""
+        with self.condition:
+            items = list(self.buffer)
+            self.buffer.clear()
+            self.condition.notify_all()
+            return items
+
+    def qsize(self):
+        return len(self.buffer)
+
+    def empty(self):
+        return not self.buffer
+
+
+class SampleBus(object):
+    """fan-out of published sample batches to every subscription and
+    listener"""
+    def __init__(self):
+        self.subscriptions = []
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, name, size=10000, policy=DROP_OLDEST):
+        """creates new buffered consumer
+
+        Arguments:
+            name   -> consumer name
+            size   -> max number of buffered samples
+            policy -> BLOCK, DROP_OLDEST or DROP_NEWEST
+
+        Returns:
+            Subscription object"""
+        subscription = Subscription(name, size, policy)
+        with self.lock:
+            self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """removes consumer, already buffered samples are kept
+
+        Arguments:
+            subscription -> Subscription object"""
+        with self.lock:
+            self.subscriptions = [s for s in self.subscriptions
+                                  if s is not subscription]
+        with subscription.condition:
+            subscription.closed = True
+            subscription.condition.notify_all()
+
+    def listen(self, callback):
+        """adds synchronous consumer called in the producer thread (must be
+        fast, e.g. rollingStats)
+
+        Arguments:
+            callback -> callable(list of samples)"""
+        with self.lock:
+            self.listeners = self.listeners + [callback]
+
+    def publish(self, samples):
+        """passes batch of samples to every consumer
+
+        Arguments:
+            samples -> list of samples"""
+        if(not samples):
+            return
+        for callback in self.listeners:
+            callback(samples)
+        for subscription in self.subscriptions:
+            subscription.publish(samples)
+
+    def stats(self):
+        """returns dict: subscription name -> (buffered, dropped)"""
+        return dict((s.name, (s.qsize(), s.dropped))
+                    for s in self.subscriptions)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+batched samples writer for saving threads
+"""
+import time
+import queue
+
+STOP = object()     # queue sentinel : write everything before it and close
+
+
+class BatchWriter(object):
+    """writes (time, value, unit) samples to the text file in batches,
+    one write() call per batch and one flush() per flushCount samples or
+    flushInterval seconds. Format : time.time()\tvalue\tunit\t\n"""
+    mode = 'a'
+    raw = False                         # writes raw frames, not samples
+
+    def __init__(self, fileName, flushInterval=1.0, flushCount=1000,
+                 batchSize=1000, latency=None):
+        """Arguments:
+            fileName      -> output file path
+            flushInterval -> max time (s) between write and flush
+            flushCount    -> max number of not flushed samples
+            batchSize     -> max number of samples formatted at once
+            latency       -> metrics.Histogram object for batch write
+                             (and flush) time, None = not measured"""
+        self.fileName = fileName
+        self.flushInterval = flushInterval
+        self.flushCount = flushCount
+        self.batchSize = batchSize
+        self.pending = 0                # samples written but not flushed
+        self.written = 0                # number of written samples
+        self.flushes = 0                # number of file flushes
+        self.skipped = 0                # records of the other mode
+        self.latency = latency
+        self.lastFlush = time.monotonic()
+        self.fo = open(fileName, self.mode)
+        self.bytes = self.fo.tell()     # file size (written, not flushed)
+
+    def _format(self, samples):
+        """formats batch of samples
+
+        Arguments:
+            samples -> list of (time, value, unit) tuples
+
+        Returns:
+            string with one line per sample"""
+        return ''.join(['%s\t%s\t%s\t\n' % sample for sample in samples])
+
+    def write(self, samples):
+        """writes batch of samples, flushes if needed
+
+        Arguments:
+            samples -> list of (time, value, unit) tuples"""
+        start = time.perf_counter()
+        data = self._format(samples)
+        self.fo.write(data)
+        self.bytes += len(data)
+        self.pending += len(samples)
+        self.written += len(samples)
+        if(self.pending >= self.flushCount):
+            self.flush()
+        else:
+            self.flushIfDue()
+        if(self.latency is not None):
+            self.latency.observe(time.perf_counter() - start)
+
+    def flushIfDue(self):
+        """flushes written samples if flushInterval passed since last flush
+        (call it periodically when no samples are written)"""
+        if(time.monotonic() - self.lastFlush >= self.flushInterval):
+            self.flush()
+
+    def flush(self):
+        """flushes written samples to the file"""
+        if(self.pending):
+            self.fo.flush()
+            self.pending = 0
+            self.flushes += 1
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        """flushes and closes the file"""
+        self.flush()
+        self.fo.close()
+
+    def drain(self, queueObj):
+        """saving thread loop, writes samples from the queue in batches
+        until STOP sentinel is received, then closes the file. Records of
+        the other mode (raw (ns, frame) records for sample writers and
+        vice versa, e.g. published by producer just before the mode
+        change) are skipped
+
+        Arguments:
+            queueObj -> queue.Queue object filled with samples"""
+        size = 2 if self.raw else 3     # record length of the writer mode
+        stop = False
+        while not stop:
+            try:
+                sample = queueObj.get(timeout=self.flushInterval)
+            except queue.Empty:
+                self.flushIfDue()       # e.g. RotatingWriter idle rotation
+                self.flush()            # bounded data loss window
+                continue
+            batch = []
+            while True:
+                if(sample is STOP):
+                    stop = True
+                    break
+                if(len(sample) == size):
+                    batch.append(sample)
+                else:
+                    self.skipped += 1
+                if(len(batch) >= self.batchSize):
+                    break
+                try:
+                    sample = queueObj.get_nowait()
+                except queue.Empty:
+                    break
+            if(batch):
+                self.write(batch)
+        self.close()
+
+
+def writerClass(extension):
+    """returns writer class for the save file extension
+
+    Arguments:
+        extension -> '.txt' (text), '.bin' (binaryLog), '.raw' (rawCapture)
+                     or '.runs' (recordFilter run-length records)
+
+    Returns:
+        BatchWriter class or subclass"""
+    if(extension == '.txt'):
+        return BatchWriter
+    if(extension == '.bin'):
+        import libs.binaryLog as bnl
+        return bnl.BinaryWriter
+    if(extension == '.raw'):
+        import libs.rawCapture as rwc
+        return rwc.RawWriter
+    if(extension == '.runs'):
+        import libs.recordFilter as rcf
+        return rcf.RunWriter
+    raise ValueError('unknown save format: ' + extension)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+acquisition in separate process : samples are passed to the GUI process
+through multiprocessing.shared_memory ring buffer (no pipes, no pickling)
+
+shared memory layout:
+    header  -> capacity (uint64), number of ever written samples (uint64),
+               device counters (uint64 each, see COUNTERS)
+    records -> capacity aligned records: float64 time, float64 value,
+               uint8 unit code (see brymen257.UNITS)
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import queue
+import time
+import numpy as np
+import libs.brymen257 as br
+
+HEADER_SIZE = 64
+# acquisition counters of the device published by the acquisition process
+COUNTERS = ('frames', 'resyncs', 'droppedBytes', 'restarts', 'cacheHits',
+            'cacheMisses')
+RECORD = np.dtype([('seconds', '<f8'), ('value', '<f8'), ('unit', 'u1')],
+                  align=True)
+
+
+class SharedRing(object):
+    """single producer, many readers ring buffer of samples in shared
+    memory, producer never waits for readers (slow readers lose samples)"""
+    def __init__(self, name=None, capacity=2 ** 16):
+        """Arguments:
+            name     -> existing shared memory name, new one if None
+            capacity -> number of records (new shared memory only)"""
+        if(name is None):
+            self.memory = shared_memory.SharedMemory(
+                create=True, size=HEADER_SIZE + capacity * RECORD.itemsize)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.memory.name
+        self.header = np.ndarray((2 + len(COUNTERS),), dtype='<u8',
+                                 buffer=self.memory.buf)
+        if(self.owner):
+            self.header[:] = 0
+            self.header[0] = capacity
+        self.capacity = int(self.header[0])
+        self.records = np.ndarray((self.capacity,), dtype=RECORD,
+                                  buffer=self.memory.buf, offset=HEADER_SIZE)
+
+    def write(self, samples):
+        """appends samples (producer only)
+
+        Arguments:
+            samples -> list of (time, value, unit) tuples"""
+        count = int(self.header[1])
+        capacity = self.capacity
+        codes = br.UNIT_CODES
+        records = self.records
+        for (i, (t, v, u)) in enumerate(samples):
+            records[(count + i) % capacity] = (t, v, codes[u])
+        self.header[1] = count + len(samples)  # publish after the records
+
+    def written(self):
+        """returns number of ever written samples"""
+        return int(self.header[1])
+
+    def setCounters(self, values):
+        """publishes device counters (producer only)
+
+        Arguments:
+            values -> COUNTERS values (see deviceCounters)"""
+        self.header[2:] = values
+
+    def counters(self):
+        """returns dict: COUNTERS name -> value"""
+        return dict(zip(COUNTERS, self.header[2:].tolist()))
+
+    def close(self):
+        """detaches (and removes if created here) shared memory"""
+        del self.header, self.records
+        self.memory.close()
+        if(self.owner):
+            self.memory.unlink()
+
+
+class RingReader(object):
+    """reading cursor of SharedRing"""
+    def __init__(self, ring, fromStart=False):
+        """Arguments:
+            ring      -> SharedRing object
+            fromStart -> read samples written before reader creation"""
+        self.ring = ring
+        self.cursor = 0 if fromStart else ring.written()
+        self.lost = 0                   # samples overwritten before reading
+
+    def read(self):
+        """returns every new record (one numpy slice copy, no parsing)
+
+        Returns:
+            numpy structured array with seconds, value, unit fields"""
+        ring = self.ring
+        capacity = ring.capacity
+        count = ring.written()
+        if(count - self.cursor > capacity):
+            self.lost += count - capacity - self.cursor
+            self.cursor = count - capacity
+        start = self.cursor % capacity
+        end = start + count - self.cursor
+        if(end <= capacity):
+            records = ring.records[start:end].copy()
+        else:
+            records = np.concatenate((ring.records[start:],
+                                      ring.records[:end - capacity]))
+        # records overwritten while copying are dropped
+        overrun = ring.written() - capacity - self.cursor
+        if(overrun > 0):
+            self.lost += overrun
+            records = records[overrun:]
+        self.cursor = count
+        return records
+
+    def readSamples(self):
+        """returns every new record as list of (time, value, unit) tuples"""
+        units = br.UNITS
+        error = br.ERROR_VALUE
+        return [(t, error if v == error else v, units[u])
+                for (t, v, u) in self.read().tolist()]
+
+
+def deviceCounters(device):
+    """returns COUNTERS values of brymen257.Brymen257 object"""
+    return (device.frameBuffer.frames, device.frameBuffer.resyncs,
+            device.frameBuffer.droppedBytes, device.restarts,
+            device.frameCache.hits, device.frameCache.misses)
+
+
+def acquire(ringName, settings, stopEvent, errors):
+    """acquisition process main function : reads multimeter and writes
+    samples and device counters into the shared ring
+
+    Arguments:
+        ringName  -> SharedRing shared memory name
+        settings  -> dict of serial.Serial attributes (port, baudrate, ...)
+        stopEvent -> multiprocessing.Event, set it to stop the process
+        errors    -> multiprocessing.Queue, gets the error message if
+                     acquisition fails (the process exits with code 1)"""
+    ring = SharedRing(ringName)
+    device = br.Brymen257(None)
+    try:
+        for (key, value) in settings.items():
+            setattr(device, key, value)
+        device.open()
+        while not stopEvent.is_set():
+            samples = list(device.readData(min(device.timeout or 0.1, 0.1)))
+            if(samples):
+                ring.write(samples)
+            ring.setCounters(deviceCounters(device))
+    except Exception as error:
+        errors.put('%s: %s' % (type(error).__name__, error))
+        errors.close()
+        errors.join_thread()            # message is sent before exit
+        raise SystemExit(1)
+    finally:
+        device.close()
+        ring.close()
+
+
+class AcquisitionProcess(object):
+    """runs acquire() in separate process with new SharedRing"""
+    def __init__(self, settings, capacity=2 ** 16):
+        """Arguments:
+            settings -> dict of serial.Serial attributes (port, baudrate,
+                        bytesize, parity, stopbits, timeout)
+            capacity -> number of samples in the shared ring"""
+        self.ring = SharedRing(capacity=capacity)
+        context = mp.get_context('spawn')   # no tkinter state in the child
+        self.stopEvent = context.Event()
+        self.errors = context.Queue()
+        self.process = context.Process(target=acquire,
+                                       args=(self.ring.name, settings,
+                                             self.stopEvent, self.errors),
+                                       daemon=True)
+
+    def start(self):
+        self.process.start()
+
+    def reader(self, fromStart=False):
+        """returns new RingReader of this process ring"""
+        return RingReader(self.ring, fromStart)
+
+    def error(self):
+        """checks if acquisition process failed
+
+        Returns:
+            error message (exception of the child process or its exit
+            code), None if process is running or was stopped by stop()"""
+        try:
+            return self.errors.get_nowait()
+        except queue.Empty:
+            pass
+        code = self.process.exitcode
+        if(code is None or self.stopEvent.is_set()):
+            return None
+        # exited before the message was received or was killed
+        try:
+            return self.errors.get(timeout=0.5)
+        except queue.Empty:
+            return 'acquisition process exited with code %d' % code
+
+    def stop(self, timeout=2.0):
+        """stops acquisition process and removes shared ring (readers
+        of the ring must be stopped first)"""
+        self.stopEvent.set()
+        self.process.join(timeout)
+        if(self.process.is_alive()):
+            self.process.terminate()
+        self.ring.close()
+
+
+if __name__ == '__main__':
+    import sys
+    port = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyUSB0'
+    acquisition = AcquisitionProcess({'port': port})
+    acquisition.start()
+    reader = acquisition.reader()
+    try:
+        while True:
+            time.sleep(0.5)
+            for sample in reader.readSamples():
+                print('\t'.join(str(x) for x in sample))
+            error = acquisition.error()
+            if(error is not None):
+                acquisition.stop()
+                sys.exit(error)
+    except KeyboardInterrupt:
+        acquisition.stop()
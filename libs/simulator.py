@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""
+Brymen 257 simulator : pseudo-terminal device emitting valid BM257 frames
+(synthetic waveforms or replay of raw captures) at any rate, with optional
+stream corruption (dropped, inserted and flipped bytes) for load testing
+without hardware
+"""
+import errno
+import math
+import os
+import pty
+import random
+import threading
+import time
+import tty
+import libs.brymen257 as br
+import libs.rawCapture as rwc
+
+# digit -> (bits 3..1 of the first byte, low nibble of the second byte)
+SEGMENTS = dict((char, (int(bits1, 2) << 1, int(bits2, 2)))
+                for ((bits1, bits2), char) in br.digits.items()
+                if (bits1, bits2) != ('000', '0000'))
+SEGMENTS['R'] = (0x00, 0x01)            # not a digit : lcd error reading
+
+# unit string -> (byte index, bit) of current type and quantity indicators
+CURRENT = {'=': (1, 0x04), '~': (1, 0x02), ' ': None}
+QUANTITY = {'O': (12, 0x04), 'H': (12, 0x02), 'F': (13, 0x04),
+            'V': (14, 0x04), 'A': (14, 0x02), ' ': None}
+# prefixes from the biggest one : (prefix, (byte index, bit))
+PREFIXES = (('M', (11, 0x02)), ('k', (11, 0x01)), (' ', None),
+            ('m', (13, 0x01)), ('u', (13, 0x02)), ('n', (12, 0x01)))
+# period bits from the most precise one (byte index, decimals)
+PERIOD_ORDER = tuple(sorted(br.PERIOD, key=lambda period: -period[1]))
+
+
+def encodeFrame(value, unit='=V'):
+    """builds raw frame displaying value (inverse of brymen257.decode_frame,
+    4 digits precision with automatic prefix and period)
+
+    Arguments:
+        value -> displayed value (br.ERROR_VALUE for lcd error reading)
+        unit  -> brymen257.UNITS string
+
+    Returns:
+        15 bytes raw data frame"""
+    frame = bytearray(i << 4 for i in range(br.FRAME_SIZE))
+    if(value < 0):
+        frame[3] |= 0x01
+    if(unit == 'C'):                     # temperature : 3 digits and blank
+        text = '%03d ' % min(round(abs(value)), 999)
+    elif(value == br.ERROR_VALUE):
+        text = 'RRRR'
+        frame[9] |= 0x01
+    else:
+        magnitude = abs(value)
+        for (prefix, bit) in PREFIXES:
+            scaled = magnitude / br.multiplier[prefix]
+            if(scaled >= 1 or prefix == 'n'):
+                break
+        if(magnitude == 0):
+            (prefix, bit, scaled) = (' ', None, 0.0)
+        for (byte, decimals) in PERIOD_ORDER:
+            digits = round(scaled * 10 ** decimals)
+            if(digits <= 9999):
+                break
+        text = '%04d' % min(digits, 9999)
+        frame[byte] |= 0x01
+        if(bit is not None):
+            frame[bit[0]] |= bit[1]
+    if(unit != 'C'):
+        for indicator in (CURRENT[unit[0]], QUANTITY[unit[1]]):
+            if(indicator is not None):
+                frame[indicator[0]] |= indicator[1]
+    for (i, char) in enumerate(text):
+        (first, second) = SEGMENTS[char]
+        frame[2 * i + 3] |= first
+        frame[2 * i + 4] |= second
+    return bytes(frame)
+
+
+def waveform(shape='sine', amplitude=1.0, frequency=1.0, offset=0.0,
+             noise=0.0, seed=None):
+    """returns synthetic signal function
+
+    Arguments:
+        shape     -> 'sine', 'square', 'ramp' or 'constant'
+        amplitude -> peak amplitude
+        frequency -> frequency (Hz)
+        offset    -> dc offset
+        noise     -> standard deviation of added gaussian noise
+        seed      -> noise random seed (reproducible runs)
+
+    Returns:
+        callable(seconds) -> value"""
+    generator = random.Random(seed)
+    shapes = {'sine': lambda phase: math.sin(2 * math.pi * phase),
+              'square': lambda phase: 1.0 if phase < 0.5 else -1.0,
+              'ramp': lambda phase: 2.0 * phase - 1.0,
+              'constant': lambda phase: 1.0}
+    if(shape not in shapes):
+        raise ValueError('unknown waveform: ' + str(shape))
+    function = shapes[shape]
+
+    def signal(seconds):
+        value = offset + amplitude * function((seconds * frequency) % 1.0)
+        if(noise):
+            value += generator.gauss(0.0, noise)
+        return value
+    return signal
+
+
+def synthetic(signal, unit='=V', rate=10.0):
+    """endless frame source with synthetic signal
+
+    Arguments:
+        signal -> callable(seconds) -> value (see waveform)
+        unit   -> brymen257.UNITS string
+        rate   -> frames per second (signal timebase)
+
+    Returns:
+        generator of raw frames"""
+    index = 0
+    while True:
+        yield encodeFrame(signal(index / rate), unit)
+        index += 1
+
+
+def replay(fileName, loop=False):
+    """frame source replaying raw capture file (see rawCapture.py)
+
+    Arguments:
+        fileName -> raw capture file path
+        loop     -> start again at the end of file
+
+    Returns:
+        generator of raw frames"""
+    while True:
+        count = 0
+        for (seconds, frame) in rwc.readFrames(fileName):
+            count += 1
+            yield frame
+        if(not loop or count == 0):
+            return
+
+
+class Corruptor(object):
+    """random byte stream corruption : dropped bytes (lost sync), inserted
+    garbage bytes (misalignment) and flipped bits"""
+    def __init__(self, drop=0.0, insert=0.0, flip=0.0, seed=None):
+        """Arguments:
+            drop   -> probability of dropping byte
+            insert -> probability of inserting random byte before byte
+            flip   -> probability of flipping one bit of byte
+            seed   -> random seed (reproducible runs)"""
+        self.drop = drop
+        self.insert = insert
+        self.flip = flip
+        self.random = random.Random(seed)
+        self.dropped = 0
+        self.inserted = 0
+        self.flipped = 0
+
+    def __call__(self, data):
+        """returns corrupted copy of data"""
+        if(not (self.drop or self.insert or self.flip)):
+            return data
+        rand = self.random.random
+        output = bytearray()
+        for byte in data:
+            if(self.insert and rand() < self.insert):
+                output.append(self.random.randrange(256))
+                self.inserted += 1
+            if(self.drop and rand() < self.drop):
+                self.dropped += 1
+                continue
+            if(self.flip and rand() < self.flip):
+                byte ^= 1 << self.random.randrange(8)
+                self.flipped += 1
+            output.append(byte)
+        return bytes(output)
+
+
+class Simulator(object):
+    """pseudo-terminal multimeter, open self.port like /dev/ttyUSB0.
+    Frames due since the previous write are written at once, so rates far
+    beyond the real meter are possible. Bytes which don't fit into the
+    pty buffer (reader too slow) are lost like in real serial overrun"""
+    def __init__(self, source, rate=10.0, corruptor=None, chunk=0.01,
+                 blocking=False):
+        """Arguments:
+            source    -> iterable of raw frames (see synthetic, replay)
+            rate      -> frames per second, None = as fast as possible
+            corruptor -> callable(bytes) -> bytes (see Corruptor)
+            chunk     -> min time between writes (s)
+            blocking  -> wait for the reader instead of overruns
+                         (throughput benchmarks)"""
+        self.source = iter(source)
+        self.rate = rate
+        self.corruptor = corruptor
+        self.chunk = chunk
+        (self.master, self.slave) = pty.openpty()
+        tty.setraw(self.slave)           # no newline translation
+        os.set_blocking(self.master, blocking)
+        self.port = os.ttyname(self.slave)
+        self.frames = 0                  # number of generated frames
+        self.overruns = 0                # bytes lost on full pty buffer
+        self.running = False
+        self.thread = None
+
+    def _write(self, data):
+        """writes data to pty, counts bytes which don't fit"""
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.master, view):]
+            except OSError as error:
+                if(error.errno not in (errno.EAGAIN, errno.EIO)):
+                    raise
+                self.overruns += len(view)
+                return
+
+    def run(self, duration=None, count=None):
+        """emits frames until stop(), duration, count or source end
+
+        Arguments:
+            duration -> max running time in seconds (None = no limit)
+            count    -> max number of frames (None = no limit)"""
+        self.running = True
+        start = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            if(duration is not None and now - start >= duration):
+                break
+            if(self.rate is None):
+                due = self.frames + 1000
+            else:
+                due = int((now - start) * self.rate) + 1
+            if(count is not None):
+                due = min(due, count)
+            frames = []
+            for frame in self.source:
+                frames.append(frame)
+                if(len(frames) >= due - self.frames):
+                    break
+            if(not frames):
+                break
+            self.frames += len(frames)
+            data = b''.join(frames)
+            if(self.corruptor is not None):
+                data = self.corruptor(data)
+            self._write(data)
+            if(count is not None and self.frames >= count):
+                break
+            if(self.rate is not None):
+                time.sleep(max(self.chunk,
+                               start + self.frames / self.rate -
+                               time.monotonic()))
+        self.running = False
+
+    def start(self, duration=None, count=None):
+        """runs emitting in separate thread (see run)"""
+        self.thread = threading.Thread(target=self.run,
+                                       args=(duration, count), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """stops emitting (pty stays open)"""
+        self.running = False
+        if(self.thread is not None):
+            self.thread.join()
+
+    def close(self):
+        """stops emitting and closes pty"""
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Brymen 257 simulator')
+    parser.add_argument('--replay', default=None,
+                        help='raw capture file (default: synthetic signal)')
+    parser.add_argument('--loop', action='store_true',
+                        help='replay capture file endlessly')
+    parser.add_argument('--wave', default='sine',
+                        choices=('sine', 'square', 'ramp', 'constant'))
+    parser.add_argument('--amplitude', type=float, default=1.0)
+    parser.add_argument('--frequency', type=float, default=0.1)
+    parser.add_argument('--offset', type=float, default=0.0)
+    parser.add_argument('--noise', type=float, default=0.0)
+    parser.add_argument('--unit', default='=V', choices=br.UNITS)
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help='frames per second, 0 = as fast as possible')
+    parser.add_argument('--drop', type=float, default=0.0,
+                        help='byte drop probability')
+    parser.add_argument('--insert', type=float, default=0.0,
+                        help='garbage byte insertion probability')
+    parser.add_argument('--flip', type=float, default=0.0,
+                        help='bit flip probability')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('-d', '--duration', type=float, default=None)
+    parser.add_argument('-n', '--count', type=int, default=None)
+    args = parser.parse_args()
+    if(args.replay is not None):
+        source = replay(args.replay, args.loop)
+    else:
+        source = synthetic(waveform(args.wave, args.amplitude, args.frequency,
+                                    args.offset, args.noise, args.seed),
+                           args.unit, args.rate or 10.0)
+    simulator = Simulator(source, args.rate or None,
+                          Corruptor(args.drop, args.insert, args.flip,
+                                    args.seed))
+    print(simulator.port, flush=True)
+    try:
+        simulator.run(args.duration, args.count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('frames:', simulator.frames, 'overruns:', simulator.overruns)
+        simulator.close()
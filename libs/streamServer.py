@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+asyncio TCP / UNIX socket server streaming live samples (and optionally
+raw frames) of many multimeters to local clients
+
+protocol:
+    server -> hello line: {"version": 1, "devices": [...], "units": [...]}
+    client -> subscription line: {"devices": [...], "encoding": "binary" or
+              "json", "raw": false} (every field is optional, default is
+              every device, binary samples)
+    server -> stream of messages:
+        binary -> MESSAGE header (payload size, kind, device index) and
+                  payload of fixed width records, kind SAMPLES has
+                  binaryLog.RECORD records (unit is UNITS index), kind RAW
+                  has rawCapture.RECORD records
+        json   -> one line per record: {"device", "seconds", "value",
+                  "unit"} or {"device", "ns", "frame" (hex)}
+"""
+import asyncio
+import collections
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import libs.brymen257 as br
+import libs.binaryLog as bnl
+import libs.rawCapture as rwc
+import libs.acquisition as acq
+
+VERSION = 1
+MESSAGE = struct.Struct('<IBH')
+SAMPLES = 0
+RAW = 1
+BINARY = 'binary'
+JSON = 'json'
+
+
+def encodeSamples(index, samples):
+    """returns binary message with (time, value, unit) samples"""
+    pack = bnl.RECORD.pack
+    codes = br.UNIT_CODES
+    payload = b''.join([pack(t, v, codes[u]) for (t, v, u) in samples])
+    return MESSAGE.pack(len(payload), SAMPLES, index) + payload
+
+
+def encodeRaw(index, records):
+    """returns binary message with (monotonic ns, raw frame) records"""
+    pack = rwc.RECORD.pack
+    payload = b''.join([pack(ns, bytes(frame)) for (ns, frame) in records])
+    return MESSAGE.pack(len(payload), RAW, index) + payload
+
+
+def jsonSamples(port, samples):
+    """returns json lines with (time, value, unit) samples"""
+    dumps = json.dumps
+    return ''.join([dumps({'device': port, 'seconds': t, 'value': v,
+                           'unit': u}) + '\n'
+                    for (t, v, u) in samples]).encode()
+
+
+def jsonRaw(port, records):
+    """returns json lines with (monotonic ns, raw frame) records"""
+    dumps = json.dumps
+    return ''.join([dumps({'device': port, 'ns': ns,
+                           'frame': bytes(frame).hex()}) + '\n'
+                    for (ns, frame) in records]).encode()
+
+
+class Client(object):
+    """one connected client : subscription and bounded output buffer, all
+    buffered messages are sent in one write"""
+    def __init__(self, writer, devices, encoding, raw, maxBuffer):
+        """Arguments:
+            writer    -> asyncio.StreamWriter object
+            devices   -> set of subscribed device indexes
+            encoding  -> BINARY or JSON
+            raw       -> send raw frames instead of samples
+            maxBuffer -> max buffered bytes, the oldest messages are dropped
+                         if client is too slow"""
+        self.writer = writer
+        self.devices = devices
+        self.encoding = encoding
+        self.raw = raw
+        self.maxBuffer = maxBuffer
+        self.buffer = collections.deque()
+        self.buffered = 0
+        self.dropped = 0                # number of dropped messages
+        self.ready = asyncio.Event()
+
+    def push(self, message):
+        """adds encoded message to the output buffer"""
+        self.buffer.append(message)
+        self.buffered += len(message)
+        while self.buffered > self.maxBuffer and len(self.buffer) > 1:
+            self.buffered -= len(self.buffer.popleft())
+            self.dropped += 1
+        self.ready.set()
+
+    async def send(self):
+        """sending loop, works until connection is closed"""
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            data = b''.join(self.buffer)
+            self.buffer.clear()
+            self.buffered = 0
+            self.writer.write(data)
+            await self.writer.drain()
+
+
+class StreamServer(object):
+    """streams data of AcquisitionEngine devices (read in separate thread)
+    to every subscribed client"""
+    def __init__(self, devices, maxBuffer=2 ** 22):
+        """Arguments:
+            devices   -> list of opened brymen257.Brymen257 objects
+            maxBuffer -> max buffered bytes per client"""
+        self.devices = list(devices)
+        # decoding happens in the loop thread, each device gets own cache
+        self.caches = [br.FrameCache() for device in self.devices]
+        self.ports = [device.port for device in self.devices]
+        self.maxBuffer = maxBuffer
+        self.clients = []
+        self.servers = []
+        self.loop = None
+        self.engine = acq.AcquisitionEngine(self._sink, raw=True)
+        self.thread = None
+        # raw frames have monotonic timestamps, samples have wall clock
+        self.offset = time.time_ns() - time.monotonic_ns()
+
+    def _sink(self, device, records):
+        """AcquisitionEngine sink (acquisition thread)"""
+        self.loop.call_soon_threadsafe(self.publish,
+                                       self.devices.index(device), records)
+
+    def publish(self, index, records):
+        """passes raw records of one device to its clients, every encoding
+        is made once per batch (event loop thread)
+
+        Arguments:
+            index   -> device index
+            records -> list of (monotonic ns, raw frame) records"""
+        messages = {}
+        for client in self.clients:
+            if(index not in client.devices):
+                continue
+            key = (client.encoding, client.raw)
+            if(key not in messages):
+                messages[key] = self._encode(index, records, *key)
+            client.push(messages[key])
+
+    def _encode(self, index, records, encoding, raw):
+        """returns records encoded for the client"""
+        if(raw):
+            if(encoding == BINARY):
+                return encodeRaw(index, records)
+            return jsonRaw(self.ports[index], records)
+        offset = self.offset
+        decode = self.caches[index].decode
+        samples = [decode(frame, (ns + offset) / 1e9)
+                   for (ns, frame) in records]
+        if(encoding == BINARY):
+            return encodeSamples(index, samples)
+        return jsonSamples(self.ports[index], samples)
+
+    async def _handle(self, reader, writer):
+        """client connection handler"""
+        hello = {'version': VERSION, 'devices': self.ports,
+                 'units': list(br.UNITS)}
+        writer.write((json.dumps(hello) + '\n').encode())
+        try:
+            request = json.loads((await reader.readline()).decode() or '{}')
+            devices = request.get('devices') or self.ports
+            for port in devices:
+                if(port not in self.ports):
+                    raise ValueError('unknown device: ' + str(port))
+            encoding = request.get('encoding', BINARY)
+            if(encoding not in (BINARY, JSON)):
+                raise ValueError('unknown encoding: ' + str(encoding))
+            client = Client(writer, set(self.ports.index(port)
+                                        for port in devices),
+                            encoding, bool(request.get('raw')),
+                            self.maxBuffer)
+        except (ValueError, AttributeError) as error:
+            writer.write((json.dumps({'error': str(error)}) + '\n').encode())
+            writer.close()
+            return
+        self.clients.append(client)
+        sending = asyncio.ensure_future(client.send())
+        # client doesn't send anything more, EOF means disconnection
+        closing = asyncio.ensure_future(reader.read())
+        try:
+            await asyncio.wait((sending, closing),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.clients.remove(client)
+            sending.cancel()
+            closing.cancel()
+            writer.close()
+
+    async def start(self, host=None, port=None, path=None):
+        """starts listening and acquisition thread
+
+        Arguments:
+            host -> TCP address (None = no TCP server)
+            port -> TCP port
+            path -> UNIX socket path (None = no UNIX server)"""
+        self.loop = asyncio.get_running_loop()
+        if(host is not None):
+            self.servers.append(await asyncio.start_server(self._handle,
+                                                           host, port))
+        if(path is not None):
+            if(os.path.exists(path)):
+                os.unlink(path)         # stale socket of previous run
+            self.servers.append(await asyncio.start_unix_server(self._handle,
+                                                                path))
+        for device in self.devices:
+            self.engine.add(device)
+        self.thread = threading.Thread(target=self.engine.run, daemon=True)
+        self.thread.start()
+
+    async def close(self):
+        """stops acquisition and closes every server and client"""
+        self.engine.stop()
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        for client in list(self.clients):
+            client.writer.close()
+        if(self.thread is not None):
+            self.thread.join()
+        self.engine.close()
+
+    def serve(self, host=None, port=None, path=None):
+        """runs server until KeyboardInterrupt (see start)"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.start(host, port, path))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.close())
+            loop.close()
+
+
+def connect(address, devices=None, raw=False, encoding=BINARY):
+    """simple blocking client for scripts
+
+    Arguments:
+        address  -> (host, port) tuple or UNIX socket path
+        devices  -> list of subscribed device paths, None = every device
+        raw      -> receive raw frames instead of samples
+        encoding -> BINARY or JSON
+
+    Returns:
+        generator of (device path, time, value, unit) tuples or
+        (device path, monotonic ns, raw frame) tuples if raw"""
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        stream = sock.makefile('rb')
+        hello = json.loads(stream.readline().decode())
+        ports = hello['devices']
+        sock.sendall((json.dumps({'devices': devices, 'raw': raw,
+                                  'encoding': encoding}) + '\n').encode())
+        # the server answers bad subscription with {"error": ...} line
+        # instead of the first message
+        first = True
+        if(encoding == JSON):
+            for line in stream:
+                record = json.loads(line.decode())
+                if(first and 'error' in record):
+                    raise ValueError(record['error'])
+                first = False
+                if(raw):
+                    yield (record['device'], record['ns'],
+                           bytes.fromhex(record['frame']))
+                else:
+                    yield (record['device'], record['seconds'],
+                           record['value'], record['unit'])
+            return
+        units = hello['units']
+        while True:
+            header = stream.read(MESSAGE.size)
+            if(len(header) < MESSAGE.size):
+                return
+            # b'{"error' as message header would be ~1.9 GB payload size
+            if(first and header == b'{"error'[:MESSAGE.size]):
+                raise ValueError(json.loads(header + stream.readline())
+                                 ['error'])
+            first = False
+            (size, kind, index) = MESSAGE.unpack(header)
+            payload = stream.read(size)
+            port = ports[index]
+            if(kind == RAW):
+                for (ns, frame) in rwc.RECORD.iter_unpack(payload):
+                    yield (port, ns, frame)
+            else:
+                for (t, v, u) in bnl.RECORD.iter_unpack(payload):
+                    if(v == br.ERROR_VALUE):
+                        v = br.ERROR_VALUE
+                    yield (port, t, v, units[u])
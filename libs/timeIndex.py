@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+sparse time index of saved text logs and fast time range queries
+
+index file (<log file>.idx):
+    header  -> MAGIC (8 bytes) + version (uint16) + entry size (uint16) +
+               4 reserved bytes
+    entries -> little endian float64 sample time, uint64 byte offset of
+               the sample line, one entry every N samples or T seconds
+
+sample times in the log are expected to be nondecreasing (time.time()
+of consecutive readings)
+"""
+import bisect
+import os
+import struct
+import libs.brymen257 as br
+import libs.sampleWriter as smw
+
+MAGIC = b'BRYIDX\x00\x01'
+VERSION = 1
+HEADER = struct.Struct('<8sHH4x')
+ENTRY = struct.Struct('<dQ')
+
+
+def indexName(fileName):
+    """returns index file path of the log file"""
+    return fileName + '.idx'
+
+
+class IndexWriter(object):
+    """appends index entries of one log file"""
+    def __init__(self, fileName, every=1000, interval=60.0):
+        """Arguments:
+            fileName -> indexed log file path
+            every    -> max number of samples between entries
+            interval -> max time (s) between entries, None = no limit"""
+        self.every = every
+        self.interval = interval
+        self.fo = open(indexName(fileName), 'ab')
+        if(self.fo.tell() == 0):
+            self.fo.write(HEADER.pack(MAGIC, VERSION, ENTRY.size))
+        self.count = None               # samples since the last entry
+        self.lastTime = None
+
+    def due(self, seconds):
+        """checks if sample at seconds needs new entry"""
+        return (self.count is None or self.count >= self.every or
+                (self.interval is not None and
+                 seconds - self.lastTime >= self.interval))
+
+    def add(self, seconds, offset):
+        """adds index entry
+
+        Arguments:
+            seconds -> sample time
+            offset  -> byte offset of the sample line"""
+        self.fo.write(ENTRY.pack(seconds, offset))
+        self.count = 0
+        self.lastTime = seconds
+
+    def flush(self):
+        self.fo.flush()
+
+    def close(self):
+        self.fo.close()
+
+
+class IndexedWriter(object):
+    """BatchWriter compatible wrapper building the index while saving,
+    batches are split at index points, so every entry gets exact offset
+    (writer.bytes before the chunk)"""
+    def __init__(self, writer, every=1000, interval=60.0):
+        """Arguments:
+            writer   -> BatchWriter object writing text lines (not
+                        RotatingWriter, segments have own offsets)
+            every    -> max number of samples between entries
+            interval -> max time (s) between entries, None = no limit"""
+        self.writer = writer
+        self.index = IndexWriter(writer.fileName, every, interval)
+        self.raw = writer.raw
+        self.flushInterval = writer.flushInterval
+        self.batchSize = writer.batchSize
+
+    def write(self, samples):
+        """writes batch of samples and index entries
+
+        Arguments:
+            samples -> list of records with time in the first field"""
+        index = self.index
+        start = 0
+        for (i, sample) in enumerate(samples):
+            if(index.due(sample[0])):
+                if(i > start):
+                    self.writer.write(samples[start:i])
+                    start = i
+                index.add(sample[0], self.writer.bytes)
+            index.count += 1
+        if(start < len(samples)):
+            self.writer.write(samples[start:])
+
+    def flushIfDue(self):
+        self.writer.flushIfDue()
+
+    def flush(self):
+        self.writer.flush()
+        self.index.flush()
+
+    def close(self):
+        self.writer.close()
+        self.index.close()
+
+    drain = smw.BatchWriter.drain
+
+    def __getattr__(self, name):
+        if(name == 'writer'):
+            raise AttributeError(name)
+        return getattr(self.writer, name)   # written, flushes, bytes, ...
+
+
+def readIndex(fileName):
+    """reads index of the log file
+
+    Arguments:
+        fileName -> log file path (not the index one)
+
+    Returns:
+        (times, offsets) lists"""
+    with open(indexName(fileName), 'rb') as fo:
+        header = fo.read(HEADER.size)
+        if(len(header) != HEADER.size or
+           HEADER.unpack(header) != (MAGIC, VERSION, ENTRY.size)):
+            raise ValueError('not supported index file')
+        data = fo.read()
+    data = data[:len(data) - len(data) % ENTRY.size]
+    entries = list(ENTRY.iter_unpack(data))
+    return ([t for (t, offset) in entries],
+            [offset for (t, offset) in entries])
+
+
+def buildIndex(fileName, every=1000, interval=60.0):
+    """indexes existing text log by scanning it once (index file is
+    replaced)
+
+    Arguments:
+        fileName -> text log file path
+        every    -> max number of samples between entries
+        interval -> max time (s) between entries, None = no limit
+
+    Returns:
+        number of index entries"""
+    if(os.path.exists(indexName(fileName))):
+        os.remove(indexName(fileName))
+    index = IndexWriter(fileName, every, interval)
+    entries = 0
+    offset = 0
+    with open(fileName, 'rb') as fi:
+        for line in fi:
+            try:
+                seconds = float(line[:line.index(b'\t')])
+            except ValueError:          # broken (e.g. last, partial) line
+                offset += len(line)
+                continue
+            if(index.due(seconds)):
+                index.add(seconds, offset)
+                entries += 1
+            index.count += 1
+            offset += len(line)
+    index.close()
+    return entries
+
+
+def byteRange(fileName, start=None, end=None, build=True):
+    """returns part of the log holding every record of the time range:
+    from the last indexed line before start to the first indexed line
+    after end
+
+    Arguments:
+        fileName -> text log (or .runs) file path
+        start    -> range start time, None = file beginning
+        end      -> range end time (inclusive), None = file end
+        build    -> build missing index first (one scan of the file)
+
+    Returns:
+        (start offset, end offset or None = file end), (0, None) if there
+        is no index"""
+    if(not os.path.exists(indexName(fileName)) and build):
+        buildIndex(fileName)
+    if(not os.path.exists(indexName(fileName))):
+        return (0, None)
+    (times, offsets) = readIndex(fileName)
+    # the last entry before start, samples between it and the next entry
+    # may still be older than start
+    first = -1 if start is None else bisect.bisect_left(times, start) - 1
+    # every sample from the first entry after end is newer than end
+    last = len(times) if end is None else bisect.bisect_right(times, end)
+    return (offsets[first] if first >= 0 else 0,
+            offsets[last] if last < len(times) else None)
+
+
+def _parse(line):
+    """returns record of the text log line : (time, value, unit) or
+    (start, value, unit, end, count) of .runs line (see
+    recordFilter.readRuns)"""
+    fields = line.split('\t')
+    value = float(fields[1])
+    if(value == br.ERROR_VALUE):
+        value = br.ERROR_VALUE
+    if(len(fields) > 4):
+        return (float(fields[0]), value, fields[2], float(fields[3]),
+                int(fields[4]))
+    return (float(fields[0]), value, fields[2])
+
+
+def query(fileName, start=None, end=None, build=True):
+    """streams records of the time range, seeks to the range using index
+
+    Arguments:
+        fileName -> text log (or .runs) file path
+        start    -> range start time, None = file beginning
+        end      -> range end time (inclusive), None = file end
+        build    -> build missing index first (one scan of the file)
+
+    Returns:
+        generator of (time, value, unit) tuples (more fields for .runs)"""
+    offset = 0 if start is None else byteRange(fileName, start, None,
+                                               build)[0]
+    with open(fileName, 'rb') as fi:
+        fi.seek(offset)
+        for line in fi:
+            try:
+                record = _parse(line.decode())
+            except (ValueError, IndexError):
+                continue                # partial line being written
+            if(start is not None and record[0] < start):
+                continue
+            if(end is not None and record[0] > end):
+                return
+            yield record
+
+
+if __name__ == '__main__':
+    import sys
+    if(len(sys.argv) not in (2, 4)):
+        sys.exit('usage: python -m libs.timeIndex LOG [START END]\n'
+                 '(builds index of text log or prints records of time '
+                 'range)')
+    if(len(sys.argv) == 2):
+        print(buildIndex(sys.argv[1]), 'index entries')
+    else:
+        for record in query(sys.argv[1], float(sys.argv[2]),
+                            float(sys.argv[3])):
+            print('\t'.join(str(field) for field in record))